@@ -0,0 +1,213 @@
+# SPDX-License-Identifier: Apache-2.0
+# Copyright 2024 Jussi Pakkanen
+
+# cython: language_level=3
+
+# Compiled replacements for the most frequently called functions of the
+# ctypes binding. The functions have the same names and take the same
+# arguments as the ctypes versions in capypdf.py so the wrapper classes
+# can call either one. Objects are passed in as the Python wrapper objects
+# and the C pointer is taken from their _as_parameter_ attribute.
+#
+# Only hot paths are here. Constructors, destructors and other rarely
+# called functions stay on ctypes.
+#
+# Errors are checked here and raised through the handler registered by
+# capypdf.py, so on success the functions return 0 without going back
+# into Python code.
+
+from libc.stdint cimport int32_t, uint32_t
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, PyBUF_SIMPLE
+
+cdef extern from "capypdf.h" nogil:
+    ctypedef int32_t CapyPDF_EC
+
+    ctypedef struct CapyPDF_DrawContext:
+        pass
+    ctypedef struct CapyPDF_Text:
+        pass
+    ctypedef struct CapyPDF_TextSequence:
+        pass
+    ctypedef struct CapyPDF_Destination:
+        pass
+    ctypedef struct CapyPDF_Outline:
+        pass
+
+    ctypedef struct CapyPDF_FontId:
+        int32_t id
+
+    CapyPDF_EC c_dc_render_text "capy_dc_render_text"(CapyPDF_DrawContext *ctx,
+                                                      const char *text,
+                                                      CapyPDF_FontId fid,
+                                                      double point_size,
+                                                      double x,
+                                                      double y)
+
+    CapyPDF_EC c_dc_cmd_m "capy_dc_cmd_m"(CapyPDF_DrawContext *ctx, double x, double y)
+    CapyPDF_EC c_dc_cmd_l "capy_dc_cmd_l"(CapyPDF_DrawContext *ctx, double x, double y)
+    CapyPDF_EC c_dc_cmd_c "capy_dc_cmd_c"(CapyPDF_DrawContext *ctx,
+                                          double x1, double y1,
+                                          double x2, double y2,
+                                          double x3, double y3)
+    CapyPDF_EC c_dc_cmd_v "capy_dc_cmd_v"(CapyPDF_DrawContext *ctx,
+                                          double x2, double y2, double x3, double y3)
+    CapyPDF_EC c_dc_cmd_y "capy_dc_cmd_y"(CapyPDF_DrawContext *ctx,
+                                          double x1, double y1, double x3, double y3)
+    CapyPDF_EC c_dc_cmd_re "capy_dc_cmd_re"(CapyPDF_DrawContext *ctx,
+                                            double x, double y, double w, double h)
+    CapyPDF_EC c_dc_cmd_h "capy_dc_cmd_h"(CapyPDF_DrawContext *ctx)
+
+    CapyPDF_EC c_text_render_text "capy_text_render_text"(CapyPDF_Text *text, const char *utf8_text)
+    CapyPDF_EC c_text_cmd_Td "capy_text_cmd_Td"(CapyPDF_Text *text, double x, double y)
+    CapyPDF_EC c_text_cmd_Tf "capy_text_cmd_Tf"(CapyPDF_Text *text, CapyPDF_FontId font, double pointsize)
+    CapyPDF_EC c_text_cmd_TJ "capy_text_cmd_TJ"(CapyPDF_Text *text, CapyPDF_TextSequence *kseq)
+
+    CapyPDF_EC c_text_sequence_append_codepoint "capy_text_sequence_append_codepoint"(
+        CapyPDF_TextSequence *tseq, uint32_t codepoint)
+    CapyPDF_EC c_text_sequence_append_codepoints "capy_text_sequence_append_codepoints"(
+        CapyPDF_TextSequence *tseq, const uint32_t *codepoints, int32_t num_codepoints)
+    CapyPDF_EC c_text_sequence_append_kerning "capy_text_sequence_append_kerning"(
+        CapyPDF_TextSequence *tseq, double kern)
+    CapyPDF_EC c_text_sequence_append_raw_glyph "capy_text_sequence_append_raw_glyph"(
+        CapyPDF_TextSequence *tseq, uint32_t glyph_id, uint32_t codepoint)
+
+    CapyPDF_EC c_destination_set_page "capy_destination_set_page"(
+        CapyPDF_Destination *dest, int32_t physical_page_number)
+    CapyPDF_EC c_outline_set_rgb "capy_outline_set_rgb"(
+        CapyPDF_Outline *outline, double r, double g, double b)
+    CapyPDF_EC c_outline_set_f "capy_outline_set_f"(CapyPDF_Outline *outline, uint32_t F)
+
+    const char *c_error_message "capy_error_message"(CapyPDF_EC error_code)
+
+
+cdef object error_handler = None
+
+def set_error_handler(handler):
+    global error_handler
+    error_handler = handler
+
+cdef int check_error(CapyPDF_EC rc) except -1 nogil:
+    if rc != 0:
+        with gil:
+            error_handler(rc)
+            return -1
+    return 0
+
+def library_address():
+    # The address of a library function as linked into this module. If it
+    # differs from the one ctypes sees, the two use different libraries.
+    return <size_t><void*>c_error_message
+
+cdef inline void* handle(object obj) except? NULL:
+    return <void*><size_t>obj._as_parameter_.value
+
+cdef inline CapyPDF_FontId font_id(object fid):
+    cdef CapyPDF_FontId result
+    result.id = fid.id
+    return result
+
+
+def capy_dc_render_text(object ctx, bytes text, object fid, double point_size, double x, double y):
+    check_error(c_dc_render_text(<CapyPDF_DrawContext*>handle(ctx), text, font_id(fid), point_size, x, y))
+    return 0
+
+def capy_dc_cmd_m(object ctx, double x, double y):
+    check_error(c_dc_cmd_m(<CapyPDF_DrawContext*>handle(ctx), x, y))
+    return 0
+
+def capy_dc_cmd_l(object ctx, double x, double y):
+    check_error(c_dc_cmd_l(<CapyPDF_DrawContext*>handle(ctx), x, y))
+    return 0
+
+def capy_dc_cmd_c(object ctx, double x1, double y1, double x2, double y2, double x3, double y3):
+    check_error(c_dc_cmd_c(<CapyPDF_DrawContext*>handle(ctx), x1, y1, x2, y2, x3, y3))
+    return 0
+
+def capy_dc_cmd_v(object ctx, double x2, double y2, double x3, double y3):
+    check_error(c_dc_cmd_v(<CapyPDF_DrawContext*>handle(ctx), x2, y2, x3, y3))
+    return 0
+
+def capy_dc_cmd_y(object ctx, double x1, double y1, double x3, double y3):
+    check_error(c_dc_cmd_y(<CapyPDF_DrawContext*>handle(ctx), x1, y1, x3, y3))
+    return 0
+
+def capy_dc_cmd_re(object ctx, double x, double y, double w, double h):
+    check_error(c_dc_cmd_re(<CapyPDF_DrawContext*>handle(ctx), x, y, w, h))
+    return 0
+
+def capy_dc_cmd_h(object ctx):
+    check_error(c_dc_cmd_h(<CapyPDF_DrawContext*>handle(ctx)))
+    return 0
+
+def capy_text_render_text(object text, bytes utf8_text):
+    check_error(c_text_render_text(<CapyPDF_Text*>handle(text), utf8_text))
+    return 0
+
+def capy_text_cmd_Td(object text, double x, double y):
+    check_error(c_text_cmd_Td(<CapyPDF_Text*>handle(text), x, y))
+    return 0
+
+def capy_text_cmd_Tf(object text, object fid, double pointsize):
+    check_error(c_text_cmd_Tf(<CapyPDF_Text*>handle(text), font_id(fid), pointsize))
+    return 0
+
+def capy_text_cmd_TJ(object text, object kseq):
+    check_error(c_text_cmd_TJ(<CapyPDF_Text*>handle(text), <CapyPDF_TextSequence*>handle(kseq)))
+    return 0
+
+def capy_text_sequence_append_codepoint(object tseq, uint32_t codepoint):
+    check_error(c_text_sequence_append_codepoint(<CapyPDF_TextSequence*>handle(tseq), codepoint))
+    return 0
+
+def capy_text_sequence_append_codepoints(object tseq, object codepoints, int32_t num_codepoints):
+    # Accepts any buffer holding native uint32 values, such as UTF-32
+    # encoded bytes or a ctypes array.
+    cdef CapyPDF_TextSequence *ts = <CapyPDF_TextSequence*>handle(tseq)
+    cdef Py_buffer view
+    PyObject_GetBuffer(codepoints, &view, PyBUF_SIMPLE)
+    try:
+        if view.len < num_codepoints * <Py_ssize_t>sizeof(uint32_t):
+            raise ValueError('Codepoint buffer is too small.')
+        with nogil:
+            check_error(c_text_sequence_append_codepoints(ts, <const uint32_t*>view.buf, num_codepoints))
+        return 0
+    finally:
+        PyBuffer_Release(&view)
+
+def capy_text_sequence_append_kerning(object tseq, double kern):
+    check_error(c_text_sequence_append_kerning(<CapyPDF_TextSequence*>handle(tseq), kern))
+    return 0
+
+def capy_text_sequence_append_raw_glyph(object tseq, uint32_t glyph_id, uint32_t codepoint):
+    check_error(c_text_sequence_append_raw_glyph(<CapyPDF_TextSequence*>handle(tseq), glyph_id, codepoint))
+    return 0
+
+def capy_destination_set_page(object dest, int32_t physical_page_number):
+    check_error(c_destination_set_page(<CapyPDF_Destination*>handle(dest), physical_page_number))
+    return 0
+
+def capy_outline_set_rgb(object outline, double r, double g, double b):
+    check_error(c_outline_set_rgb(<CapyPDF_Outline*>handle(outline), r, g, b))
+    return 0
+
+def capy_outline_set_f(object outline, uint32_t F):
+    check_error(c_outline_set_f(<CapyPDF_Outline*>handle(outline), F))
+    return 0
+
+
+# Fused helpers that have no counterpart in the C API. Each one replaces
+# a loop of calls into this module with a single crossing.
+
+def render_text_runs(object ctx, object runs, object fid, double point_size):
+    # Runs are (text, x, y) tuples. Stops at the first error.
+    cdef CapyPDF_DrawContext *dc = <CapyPDF_DrawContext*>handle(ctx)
+    cdef CapyPDF_FontId f = font_id(fid)
+    cdef bytes encoded
+    cdef const char *p
+    cdef double x, y
+    for text, x, y in runs:
+        encoded = (<str?>text).encode('UTF-8')
+        p = encoded
+        with nogil:
+            check_error(c_dc_render_text(dc, p, f, point_size, x, y))
+    return 0
@@ -5,6 +5,10 @@
 import ctypes
 import os, sys
 import math
+import functools
+import array
+import atexit
+import struct
 from enum import Enum, IntFlag, auto
 
 class LineCapStyle(Enum):
@@ -17,6 +21,15 @@ class LineJoinStyle(Enum):
     Round = 1
     Bevel = 2
 
+class PathOp(Enum):
+    M = 0
+    L = 1
+    C = 2
+    V = 3
+    Y = 4
+    RE = 5
+    H = 6
+
 class BlendMode(Enum):
     Normal = 0
     Multiply = 1
@@ -268,6 +281,7 @@ cfunc_types = (
 ('capy_generator_add_graphics_state', [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]),
 ('capy_generator_add_optional_content_group', [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]),
 ('capy_generator_add_outline', [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]),
+('capy_generator_create_annotation', [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]),
 ('capy_generator_create_separation_simple', [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_void_p, ctypes.c_void_p]),
 ('capy_generator_text_width', [ctypes.c_void_p, ctypes.c_char_p, FontId, ctypes.c_double, ctypes.POINTER(ctypes.c_double)]),
 ('capy_generator_add_rolemap_entry', [ctypes.c_void_p, ctypes.c_char_p, enum_type, ctypes.c_void_p]),
@@ -279,12 +293,14 @@ cfunc_types = (
 ('capy_dc_cmd_B', [ctypes.c_void_p]),
 ('capy_dc_cmd_bstar', [ctypes.c_void_p]),
 ('capy_dc_cmd_Bstar', [ctypes.c_void_p]),
+('capy_dc_cmd_BDC_builtin', [ctypes.c_void_p, StructureItemId]),
 ('capy_dc_cmd_BDC_ocg', [ctypes.c_void_p, OptionalContentGroupId]),
 ('capy_dc_cmd_BMC', [ctypes.c_void_p, ctypes.c_char_p]),
 ('capy_dc_cmd_c', [ctypes.c_void_p,
     ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double]),
 ('capy_dc_cmd_cm', [ctypes.c_void_p,
     ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double]),
+('capy_dc_cmd_cm6', [ctypes.c_void_p, ctypes.POINTER(ctypes.c_double)]),
 ('capy_dc_cmd_d', [ctypes.c_void_p, ctypes.POINTER(ctypes.c_double), ctypes.c_int32, ctypes.c_double]),
 ('capy_dc_cmd_EMC', [ctypes.c_void_p]),
 ('capy_dc_cmd_f', [ctypes.c_void_p]),
@@ -315,6 +331,11 @@ cfunc_types = (
 ('capy_dc_cmd_w', [ctypes.c_void_p, ctypes.c_double]),
 ('capy_dc_cmd_W', [ctypes.c_void_p]),
 ('capy_dc_cmd_Wstar', [ctypes.c_void_p]),
+('capy_dc_run_path_ops', [ctypes.c_void_p,
+                          ctypes.POINTER(ctypes.c_uint8),
+                          ctypes.c_int32,
+                          ctypes.POINTER(ctypes.c_double),
+                          ctypes.c_int32]),
 ('capy_dc_cmd_y', [ctypes.c_void_p, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double]),
 ('capy_dc_set_custom_page_properties', [ctypes.c_void_p, ctypes.c_void_p]),
 ('capy_dc_draw_image',
@@ -323,7 +344,9 @@ cfunc_types = (
     [ctypes.c_void_p, ctypes.c_char_p, FontId, ctypes.c_double, ctypes.c_double, ctypes.c_double]),
 ('capy_dc_render_text_obj',
     [ctypes.c_void_p, ctypes.c_void_p]),
+('capy_dc_set_stroke', [ctypes.c_void_p, ctypes.c_void_p]),
 ('capy_dc_set_nonstroke', [ctypes.c_void_p, ctypes.c_void_p]),
+('capy_dc_set_page_transition', [ctypes.c_void_p, ctypes.c_void_p]),
 ('capy_dc_text_new', [ctypes.c_void_p, ctypes.c_void_p]),
 ('capy_dc_annotate', [ctypes.c_void_p, AnnotationId]),
 ('capy_dc_destroy', [ctypes.c_void_p]),
@@ -333,6 +356,7 @@ cfunc_types = (
 
 ('capy_text_sequence_new', [ctypes.c_void_p]),
 ('capy_text_sequence_append_codepoint', [ctypes.c_void_p, ctypes.c_uint32]),
+('capy_text_sequence_append_codepoints', [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int32]),
 ('capy_text_sequence_append_kerning', [ctypes.c_void_p, ctypes.c_double]),
 ('capy_text_sequence_append_actualtext_start', [ctypes.c_void_p, ctypes.c_char_p]),
 ('capy_text_sequence_append_actualtext_end', [ctypes.c_void_p]),
@@ -349,6 +373,7 @@ cfunc_types = (
 ('capy_text_cmd_TL', [ctypes.c_void_p, ctypes.c_double]),
 ('capy_text_cmd_Tm', [ctypes.c_void_p,
     ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double]),
+('capy_text_cmd_Tm6', [ctypes.c_void_p, ctypes.POINTER(ctypes.c_double)]),
 ('capy_text_cmd_Tr', [ctypes.c_void_p, enum_type]),
 ('capy_text_cmd_Tw', [ctypes.c_void_p, ctypes.c_double]),
 ('capy_text_cmd_Tstar', [ctypes.c_void_p]),
@@ -358,6 +383,7 @@ cfunc_types = (
 
 ('capy_color_new', [ctypes.c_void_p]),
 ('capy_color_destroy', [ctypes.c_void_p]),
+('capy_color_reset', [ctypes.c_void_p]),
 ('capy_color_set_rgb', [ctypes.c_void_p, ctypes.c_double, ctypes.c_double, ctypes.c_double]),
 ('capy_color_set_gray', [ctypes.c_void_p, ctypes.c_double]),
 ('capy_color_set_cmyk', [ctypes.c_void_p, ctypes.c_double, ctypes.c_double, ctypes.c_double, ctypes.c_double]),
@@ -381,7 +407,7 @@ cfunc_types = (
 
 ('capy_raster_image_builder_new', [ctypes.c_void_p]),
 ('capy_raster_image_builder_set_size', [ctypes.c_void_p, ctypes.c_int32, ctypes.c_int32]),
-('capy_raster_image_builder_set_pixel_data', [ctypes.c_void_p, ctypes.c_char_p, ctypes.c_int32]),
+('capy_raster_image_builder_set_pixel_data', [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_int32]),
 ('capy_raster_image_builder_build', [ctypes.c_void_p, ctypes.c_void_p]),
 ('capy_raster_image_get_colorspace', [ctypes.c_void_p, ctypes.POINTER(enum_type)]),
 ('capy_raster_image_has_profile', [ctypes.c_void_p, ctypes.POINTER(ctypes.c_int32)]),
@@ -410,6 +436,14 @@ cfunc_types = (
 ('capy_type4_shading_add_triangle', [ctypes.c_void_p,
                                      ctypes.POINTER(ctypes.c_double),
                                      ctypes.c_void_p]),
+('capy_type4_shading_add_triangles', [ctypes.c_void_p,
+                                      ctypes.POINTER(ctypes.c_double),
+                                      ctypes.c_void_p,
+                                      ctypes.c_int32]),
+('capy_type4_shading_add_triangles_rgb', [ctypes.c_void_p,
+                                          ctypes.POINTER(ctypes.c_double),
+                                          ctypes.POINTER(ctypes.c_double),
+                                          ctypes.c_int32]),
 ('capy_type4_shading_extend', [ctypes.c_void_p,
                                ctypes.c_int32,
                                ctypes.POINTER(ctypes.c_double),
@@ -420,6 +454,10 @@ cfunc_types = (
 ('capy_type6_shading_add_patch', [ctypes.c_void_p,
                                   ctypes.POINTER(ctypes.c_double),
                                   ctypes.c_void_p]),
+('capy_type6_shading_add_patches', [ctypes.c_void_p,
+                                    ctypes.POINTER(ctypes.c_double),
+                                    ctypes.c_void_p,
+                                    ctypes.c_int32]),
 ('capy_type6_shading_extend', [ctypes.c_void_p,
                                ctypes.c_int32,
                                ctypes.POINTER(ctypes.c_double),
@@ -447,7 +485,7 @@ cfunc_types = (
 
 ('capy_destination_new', [ctypes.c_void_p]),
 ('capy_destination_set_page', [ctypes.c_void_p, ctypes.c_int32]),
-('capy_destination_set_xyz', [ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p, ctypes.c_void_p]),
+('capy_destination_set_xyz_packed', [ctypes.c_void_p, ctypes.POINTER(ctypes.c_double), ctypes.c_uint32]),
 ('capy_destination_destroy', [ctypes.c_void_p]),
 
 ('capy_outline_new', [ctypes.c_void_p]),
@@ -469,7 +507,9 @@ else:
 libfile = None
 
 if 'CAPYPDF_SO_OVERRIDE' in os.environ:
-    libfile = ctypes.cdll.LoadLibrary(os.path.join(os.environ['CAPYPDF_SO_OVERRIDE'], libfile_name))
+    # An absolute path makes dlopen load exactly this file instead of
+    # searching the library path.
+    libfile = ctypes.cdll.LoadLibrary(os.path.abspath(os.path.join(os.environ['CAPYPDF_SO_OVERRIDE'], libfile_name)))
 
 if libfile is None:
     try:
@@ -491,11 +531,27 @@ if libfile is None:
 if libfile is None:
     raise CapyPDFException('Could not locate shared library.')
 
-for funcname, argtypes in cfunc_types:
-    funcobj = getattr(libfile, funcname)
-    if argtypes is not None:
-        funcobj.argtypes = argtypes
-    funcobj.restype = ec_type
+class LazyLibrary:
+    '''Sets up function prototypes on first use rather than at import time.
+
+    Resolved functions are stored as instance attributes so __getattr__
+    is only called once per function.'''
+
+    def __init__(self, lib, prototypes):
+        self.lib = lib
+        self.prototypes = prototypes
+
+    def __getattr__(self, funcname):
+        funcobj = getattr(self.lib, funcname)
+        if funcname in self.prototypes:
+            argtypes = self.prototypes[funcname]
+            if argtypes is not None:
+                funcobj.argtypes = argtypes
+            funcobj.restype = ec_type
+        setattr(self, funcname, funcobj)
+        return funcobj
+
+libfile = LazyLibrary(libfile, dict(cfunc_types))
 
 # This is the only function in the public API not to return an errorcode.
 libfile.capy_error_message.argtypes = [ctypes.c_int32]
@@ -511,6 +567,21 @@ def check_error(errorcode):
     if errorcode != 0:
         raise_with_error(errorcode)
 
+# If the compiled extension module is available, it provides faster
+# versions of the most frequently called functions with the same names
+# and arguments as in libfile. It is linked against the library it was
+# built with, so it is only used if that is the library loaded above.
+# Otherwise objects created by one library would be passed to the other.
+fastlib = libfile
+try:
+    import _capypdf_fast
+except ImportError:
+    pass
+else:
+    if _capypdf_fast.library_address() == ctypes.cast(libfile.capy_error_message, ctypes.c_void_p).value:
+        fastlib = _capypdf_fast
+        fastlib.set_error_handler(raise_with_error)
+
 def to_bytepath(filename):
     if isinstance(filename, bytes):
         return filename
@@ -519,19 +590,89 @@ def to_bytepath(filename):
     else:
         return str(filename).encode('UTF-8')
 
-def to_array(ctype, array):
-    if not isinstance(array, (list, tuple)):
-        raise CapyPDFException('Array value argument must be an list or tuple.')
-    return (ctype * len(array))(*array), len(array)
+utf32_encoding = 'UTF-32-LE' if sys.byteorder == 'little' else 'UTF-32-BE'
+
+def to_color_array(colors):
+    arr = array_type(ctypes.c_void_p, len(colors))()
+    for i, c in enumerate(colors):
+        if not isinstance(c, Color):
+            raise CapyPDFException('Color argument not a color object.')
+        arr[i] = c._as_parameter_
+    return arr
+
+@functools.lru_cache(maxsize=None)
+def array_type(ctype, length):
+    return ctype * length
+
+# Buffer formats that can be converted element by element, grouped by
+# kind. Integers are never read as floats or vice versa.
+float_formats = frozenset('fd')
+int_formats = frozenset('bBhHiIlLqQnN')
+
+def native_format(fmt):
+    # ctypes arrays describe their elements with an explicit byte order,
+    # such as '<d'. Formats whose layout equals the native one are
+    # reduced to the plain type code, others return None.
+    order, code = fmt[:1], fmt[1:]
+    if order == '@':
+        return code
+    if not order or order not in '<>=!':
+        return fmt
+    if order != '=' and (order == '<') != (sys.byteorder == 'little'):
+        return None
+    try:
+        if struct.calcsize(fmt) != struct.calcsize(code):
+            return None
+    except struct.error:
+        return None
+    return code
+
+def to_array(ctype, values):
+    if isinstance(values, (list, tuple)):
+        n = len(values)
+        try:
+            if ctype._type_ in array.typecodes:
+                # array.array converts the elements in C, which is a lot
+                # faster than unpacking them into the ctypes constructor.
+                return array_type(ctype, n).from_buffer(array.array(ctype._type_, values)), n
+            return array_type(ctype, n)(*values), n
+        except (OverflowError, TypeError) as e:
+            raise CapyPDFException(f'Bad array element: {e}') from None
+    # Objects that export a buffer (array.array, NumPy arrays etc) holding
+    # elements of the correct type are passed to C without a copy.
+    try:
+        view = memoryview(values)
+    except TypeError:
+        raise CapyPDFException('Array value argument must be a list, tuple or buffer object.') from None
+    fmt = native_format(view.format)
+    if fmt == ctype._type_ and view.c_contiguous:
+        flat = view.cast('B').cast(fmt)
+        arraytype = array_type(ctype, len(flat))
+        if flat.readonly:
+            return arraytype.from_buffer_copy(flat), len(flat)
+        return arraytype.from_buffer(flat), len(flat)
+    kinds = float_formats if ctype._type_ in float_formats else int_formats
+    if fmt not in kinds:
+        raise CapyPDFException(f'Array buffer has element format {view.format!r}, which can not be converted to {ctype.__name__}.')
+    if view.c_contiguous:
+        view = view.cast('B').cast(fmt)
+    elif view.ndim != 1 or view.format.lstrip('@') != fmt:
+        raise CapyPDFException('Multidimensional and non-native order array buffers must be contiguous.')
+    return to_array(ctype, view.tolist())
 
 class Options:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self):
         opt = ctypes.c_void_p()
-        check_error(libfile.capy_options_new(ctypes.pointer(opt)))
+        check_error(libfile.capy_options_new(ctypes.byref(opt)))
         self._as_parameter_ = opt
 
     def __del__(self):
-        check_error(libfile.capy_options_destroy(self))
+        # Destroy functions can not fail. Exceptions raised in __del__
+        # are ignored in any case, so the return values of destroy
+        # functions are not checked anywhere.
+        libfile.capy_options_destroy(self)
 
     def set_colorspace(self, cs):
         if not isinstance(cs, DeviceColorspace):
@@ -580,25 +721,32 @@ class Options:
 
 
 class PageProperties:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self):
         opt = ctypes.c_void_p()
-        check_error(libfile.capy_page_properties_new(ctypes.pointer(opt)))
+        check_error(libfile.capy_page_properties_new(ctypes.byref(opt)))
         self._as_parameter_ = opt
 
     def __del__(self):
-        check_error(libfile.capy_page_properties_destroy(self))
+        libfile.capy_page_properties_destroy(self)
 
     def set_pagebox(self, boxtype, x1, y1, x2, y2):
         check_error(libfile.capy_page_properties_set_pagebox(self, boxtype.value, x1, y1, x2, y2))
 
 
 class DrawContextBase:
+    __slots__ = ('_as_parameter_', 'generator', 'matrix', '__weakref__')
 
     def __init__(self, generator):
         self.generator = generator
+        # Transformation matrices are passed via a pointer to this
+        # preallocated array, which is cheaper than converting six
+        # separate arguments on every call.
+        self.matrix = (ctypes.c_double * 6)()
 
     def __del__(self):
-        check_error(libfile.capy_dc_destroy(self))
+        libfile.capy_dc_destroy(self)
 
     def cmd_b(self):
         check_error(libfile.capy_dc_cmd_b(self))
@@ -629,10 +777,12 @@ class DrawContextBase:
         return MarkedContextManager(self)
 
     def cmd_c(self, x1, y1, x2, y2, x3, y3):
-        check_error(libfile.capy_dc_cmd_c(self, x1, y1, x2, y2, x3, y3))
+        check_error(fastlib.capy_dc_cmd_c(self, x1, y1, x2, y2, x3, y3))
 
     def cmd_cm(self, m1, m2, m3, m4, m5, m6):
-        check_error(libfile.capy_dc_cmd_cm(self, m1, m2, m3, m4, m5, m6))
+        m = self.matrix
+        m[:] = (m1, m2, m3, m4, m5, m6)
+        check_error(libfile.capy_dc_cmd_cm6(self, m))
 
     def cmd_d(self, array, phase):
         check_error(libfile.capy_dc_cmd_d(self, *to_array(ctypes.c_double, array), phase))
@@ -658,7 +808,7 @@ class DrawContextBase:
         check_error(libfile.capy_dc_cmd_gs(self, gsid))
 
     def cmd_h(self):
-        check_error(libfile.capy_dc_cmd_h(self))
+        check_error(fastlib.capy_dc_cmd_h(self))
 
     def cmd_i(self, flatness):
         check_error(libfile.capy_dc_cmd_i(self, flatness))
@@ -676,10 +826,10 @@ class DrawContextBase:
         check_error(libfile.capy_dc_cmd_K(self, c, m, y, k))
 
     def cmd_l(self, x, y):
-        check_error(libfile.capy_dc_cmd_l(self, x, y))
+        check_error(fastlib.capy_dc_cmd_l(self, x, y))
 
     def cmd_m(self, x, y):
-        check_error(libfile.capy_dc_cmd_m(self, x, y))
+        check_error(fastlib.capy_dc_cmd_m(self, x, y))
 
     def cmd_M(self, miterlimit):
         check_error(libfile.capy_dc_cmd_M(self, miterlimit))
@@ -694,7 +844,7 @@ class DrawContextBase:
         check_error(libfile.capy_dc_cmd_Q(self))
 
     def cmd_re(self, x, y, w, h):
-        check_error(libfile.capy_dc_cmd_re(self, x, y, w, h))
+        check_error(fastlib.capy_dc_cmd_re(self, x, y, w, h))
 
     def cmd_RG(self, r, g, b):
         check_error(libfile.capy_dc_cmd_RG(self, r, g, b))
@@ -717,7 +867,7 @@ class DrawContextBase:
         check_error(libfile.capy_dc_cmd_sh(self, shid))
 
     def cmd_v(self, x2, y2, x3, y3):
-        check_error(libfile.capy_dc_cmd_v(self, x2, y2, x3, y3))
+        check_error(fastlib.capy_dc_cmd_v(self, x2, y2, x3, y3))
 
     def cmd_w(self, line_width):
         check_error(libfile.capy_dc_cmd_w(self, line_width))
@@ -729,7 +879,19 @@ class DrawContextBase:
         check_error(libfile.capy_dc_cmd_Wstar(self))
 
     def cmd_y(self, x1, y1, x3, y3):
-        check_error(libfile.capy_dc_cmd_y(self, x1, y1, x3, y3))
+        check_error(fastlib.capy_dc_cmd_y(self, x1, y1, x3, y3))
+
+    def run_path_ops(self, ops, coords):
+        '''Runs a sequence of path construction operators with one call.
+
+        Ops is a sequence of PathOp values or a buffer of their integer
+        values, for example an array.array('B'). The arguments of all
+        operators are taken from coords in order.'''
+        if isinstance(ops, (list, tuple)):
+            ops = [op.value if isinstance(op, PathOp) else op for op in ops]
+        oparr, num_ops = to_array(ctypes.c_uint8, ops)
+        coordarr, num_coords = to_array(ctypes.c_double, coords)
+        check_error(libfile.capy_dc_run_path_ops(self, oparr, num_ops, coordarr, num_coords))
 
     def set_stroke(self, color):
         if isinstance(color, PatternId):
@@ -750,18 +912,32 @@ class DrawContextBase:
         check_error(libfile.capy_dc_set_nonstroke(self, color))
 
     def render_text(self, text, fid, point_size, x, y):
-        if not isinstance(text, str):
+        # Type checks that merely produce nicer error messages are
+        # compiled out with python -O. Ones that protect pointer
+        # arguments passed to C must stay.
+        if __debug__ and not isinstance(text, str):
             raise CapyPDFException('Text to render is not a string.')
-        if not isinstance(fid, FontId):
+        if __debug__ and not isinstance(fid, FontId):
             raise CapyPDFException('Font id argument is not a font id object.')
         text_bytes = text.encode('UTF-8')
-        check_error(libfile.capy_dc_render_text(self, text_bytes, fid, point_size, x, y))
+        check_error(fastlib.capy_dc_render_text(self, text_bytes, fid, point_size, x, y))
+
+    def render_text_runs(self, runs, fid, point_size):
+        '''Renders a sequence of (text, x, y) tuples using the same font
+        and size. With the compiled module this is a single call.'''
+        if __debug__ and not isinstance(fid, FontId):
+            raise CapyPDFException('Font id argument is not a font id object.')
+        if fastlib is libfile:
+            for text, x, y in runs:
+                self.render_text(text, fid, point_size, x, y)
+        else:
+            check_error(fastlib.render_text_runs(self, runs, fid, point_size))
 
     def render_text_obj(self, tobj):
         check_error(libfile.capy_dc_render_text_obj(self, tobj))
 
     def draw_image(self, iid):
-        if not isinstance(iid, ImageId):
+        if __debug__ and not isinstance(iid, ImageId):
             raise CapyPDFException('Image id argument is not an image id object.')
         check_error(libfile.capy_dc_draw_image(self, iid))
 
@@ -780,14 +956,17 @@ class DrawContextBase:
         self.cmd_cm(xscale, 0, 0, yscale, 0, 0)
 
     def rotate(self, angle):
-        self.cmd_cm(math.cos(angle), math.sin(angle), -math.sin(angle), math.cos(angle), 0.0, 0.0)
+        c = math.cos(angle)
+        s = math.sin(angle)
+        self.cmd_cm(c, s, -s, c, 0.0, 0.0)
 
 class DrawContext(DrawContextBase):
+    __slots__ = ()
 
     def __init__(self, generator):
         super().__init__(generator)
         dcptr = ctypes.c_void_p()
-        check_error(libfile.capy_page_draw_context_new(generator, ctypes.pointer(dcptr)))
+        check_error(libfile.capy_page_draw_context_new(generator, ctypes.byref(dcptr)))
         self._as_parameter_ = dcptr
 
     def __enter__(self):
@@ -803,13 +982,14 @@ class DrawContext(DrawContextBase):
         return StateContextManager(self)
 
     def add_simple_navigation(self, ocgs, transition=None):
-        arraytype = len(ocgs)*OptionalContentGroupId
-        arr = arraytype(*tuple(ocgs))
+        # OptionalContentGroupId is a plain int32 so the ids can be packed
+        # directly instead of copying Structure objects one by one.
+        arr, num_ocgs = to_array(ctypes.c_int32, [ocg.id for ocg in ocgs])
         if transition is not None and not isinstance(transition, Transition):
             raise CapyPDFException('Transition argument must be a transition object.')
         check_error(libfile.capy_dc_add_simple_navigation(self,
-                                                          ctypes.pointer(arr),
-                                                          len(ocgs),
+                                                          arr,
+                                                          num_ocgs,
                                                           transition))
 
     def set_custom_page_properties(self, props):
@@ -821,23 +1001,27 @@ class DrawContext(DrawContextBase):
         check_error(libfile.capy_dc_annotate(self, annotation_id))
 
 class ColorPatternDrawContext(DrawContextBase):
+    __slots__ = ()
 
     def __init__(self, generator, w, h):
         super().__init__(generator)
         dcptr = ctypes.c_void_p()
-        check_error(libfile.capy_color_pattern_context_new(generator, ctypes.pointer(dcptr), w, h))
+        check_error(libfile.capy_color_pattern_context_new(generator, ctypes.byref(dcptr), w, h))
         self._as_parameter_ = dcptr
 
 class FormXObjectDrawContext(DrawContextBase):
+    __slots__ = ()
 
     def __init__(self, generator, w, h):
         super().__init__(generator)
         dcptr = ctypes.c_void_p()
-        check_error(libfile.capy_form_xobject_new(generator, w, h, ctypes.pointer(dcptr)))
+        check_error(libfile.capy_form_xobject_new(generator, w, h, ctypes.byref(dcptr)))
         self._as_parameter_ = dcptr
 
 
 class StateContextManager:
+    __slots__ = ('ctx', '__weakref__')
+
     def __init__(self, ctx):
         self.ctx = ctx
         ctx.cmd_q()
@@ -849,6 +1033,7 @@ class StateContextManager:
         self.ctx.cmd_Q()
 
 class MarkedContextManager:
+    __slots__ = ('dc', '__weakref__')
 
     def __init__(self, dc):
         self.dc = dc
@@ -863,17 +1048,25 @@ class MarkedContextManager:
             self.dc = None # Not very elegant.
 
 class Generator:
+    __slots__ = ('_as_parameter_', 'width_cache', '__weakref__')
+
+    # Text widths never change once a font is loaded so they are cached
+    # per generator. Layout code tends to measure the same words over
+    # and over again.
+    max_width_cache_size = 65536
+
     def __init__(self, filename, options=None):
+        self.width_cache = {}
         file_name_bytes = to_bytepath(filename)
         if options is None:
             options = Options()
         gptr = ctypes.c_void_p()
-        check_error(libfile.capy_generator_new(file_name_bytes, options, ctypes.pointer(gptr)))
+        check_error(libfile.capy_generator_new(file_name_bytes, options, ctypes.byref(gptr)))
         self._as_parameter_ = gptr
 
     def __del__(self):
         if self._as_parameter_ is not None:
-            check_error(libfile.capy_generator_destroy(self))
+            libfile.capy_generator_destroy(self)
 
     def __enter__(self):
         return self
@@ -895,51 +1088,51 @@ class Generator:
 
     def add_form_xobject(self, fxo_ctx):
         fxid = FormXObjectId()
-        check_error(libfile.capy_generator_add_form_xobject(self, fxo_ctx, ctypes.pointer(fxid)))
+        check_error(libfile.capy_generator_add_form_xobject(self, fxo_ctx, ctypes.byref(fxid)))
         return fxid
 
     def add_color_pattern(self, pattern_ctx):
         pid = PatternId()
-        check_error(libfile.capy_generator_add_color_pattern(self, pattern_ctx, ctypes.pointer(pid)))
+        check_error(libfile.capy_generator_add_color_pattern(self, pattern_ctx, ctypes.byref(pid)))
         return pid
 
     def embed_jpg(self, fname, interpolate=ImageInterpolation.Automatic):
         if not isinstance(interpolate, ImageInterpolation):
             raise CapyPDFException('Argument must be an image interpolation.')
         iid = ImageId()
-        check_error(libfile.capy_generator_embed_jpg(self, to_bytepath(fname), interpolate.value, ctypes.pointer(iid)))
+        check_error(libfile.capy_generator_embed_jpg(self, to_bytepath(fname), interpolate.value, ctypes.byref(iid)))
         return iid
 
     def embed_file(self, fname):
         fid = EmbeddedFileId()
-        check_error(libfile.capy_generator_embed_file(self, to_bytepath(fname), ctypes.pointer(fid)))
+        check_error(libfile.capy_generator_embed_file(self, to_bytepath(fname), ctypes.byref(fid)))
         return fid
 
     def load_font(self, fname):
         fid = FontId()
-        check_error(libfile.capy_generator_load_font(self, to_bytepath(fname), ctypes.pointer(fid)))
+        check_error(libfile.capy_generator_load_font(self, to_bytepath(fname), ctypes.byref(fid)))
         return fid
 
     def load_icc_profile(self, fname):
         iid = IccColorSpaceId()
-        check_error(libfile.capy_generator_load_icc_profile(self, to_bytepath(fname), ctypes.pointer(iid)))
+        check_error(libfile.capy_generator_load_icc_profile(self, to_bytepath(fname), ctypes.byref(iid)))
         return iid
 
     def add_lab_colorspace(self, xw, yw, zw, amin, amax, bmin, bmax):
         lid = LabColorSpaceId()
-        check_error(libfile.capy_generator_add_lab_colorspace(self, xw, yw, zw, amin, amax, bmin, bmax, ctypes.pointer(lid)))
+        check_error(libfile.capy_generator_add_lab_colorspace(self, xw, yw, zw, amin, amax, bmin, bmax, ctypes.byref(lid)))
         return lid
 
     def load_image(self, fname):
         optr = ctypes.c_void_p()
-        check_error(libfile.capy_generator_load_image(self, to_bytepath(fname), ctypes.pointer(optr)))
+        check_error(libfile.capy_generator_load_image(self, to_bytepath(fname), ctypes.byref(optr)))
         return RasterImage(optr)
 
     def convert_image(self, in_image, output_cs, ri):
         if not isinstance(in_image, RasterImage):
             raise CapyPDFException('First argument must be a RasterImage object.')
         optr = ctypes.c_void_p()
-        check_error(libfile.capy_generator_convert_image(self, in_image, output_cs.value, ri.value, ctypes.pointer(optr)))
+        check_error(libfile.capy_generator_convert_image(self, in_image, output_cs.value, ri.value, ctypes.byref(optr)))
         return RasterImage(optr)
 
     def add_image(self, ri, params):
@@ -948,51 +1141,51 @@ class Generator:
         if not isinstance(params, ImagePdfProperties):
             raise CapyPDFException('Second argument must be an PDF property object.')
         iid = ImageId()
-        check_error(libfile.capy_generator_add_image(self, ri, params, ctypes.pointer(iid)))
+        check_error(libfile.capy_generator_add_image(self, ri, params, ctypes.byref(iid)))
         return iid
 
     def add_type2_function(self, type2func):
         if not isinstance(type2func, Type2Function):
             raise CapyPDFException('Argument must be a function.')
         fid = FunctionId()
-        check_error(libfile.capy_generator_add_type2_function(self, type2func, ctypes.pointer(fid)))
+        check_error(libfile.capy_generator_add_type2_function(self, type2func, ctypes.byref(fid)))
         return fid
 
     def add_type2_shading(self, type2shade):
         if not isinstance(type2shade, Type2Shading):
             raise CapyPDFException('Argument must be a type 2 shading object.')
         shid = ShadingId()
-        check_error(libfile.capy_generator_add_type2_shading(self, type2shade, ctypes.pointer(shid)))
+        check_error(libfile.capy_generator_add_type2_shading(self, type2shade, ctypes.byref(shid)))
         return shid
 
     def add_type3_shading(self, type3shade):
         if not isinstance(type3shade, Type3Shading):
             raise CapyPDFException('Argument must be a type 3 shading object.')
         shid = ShadingId()
-        check_error(libfile.capy_generator_add_type3_shading(self, type3shade, ctypes.pointer(shid)))
+        check_error(libfile.capy_generator_add_type3_shading(self, type3shade, ctypes.byref(shid)))
         return shid
 
     def add_type4_shading(self, type4shade):
         if not isinstance(type4shade, Type4Shading):
             raise CapyPDFException('Argument must be a type 4 shading object.')
         shid = ShadingId()
-        check_error(libfile.capy_generator_add_type4_shading(self, type4shade, ctypes.pointer(shid)))
+        check_error(libfile.capy_generator_add_type4_shading(self, type4shade, ctypes.byref(shid)))
         return shid
 
     def add_type6_shading(self, type6shade):
         if not isinstance(type6shade, Type6Shading):
             raise CapyPDFException('Argument must be a type 4 shading object.')
         shid = ShadingId()
-        check_error(libfile.capy_generator_add_type6_shading(self, type6shade, ctypes.pointer(shid)))
+        check_error(libfile.capy_generator_add_type6_shading(self, type6shade, ctypes.byref(shid)))
         return shid
 
     def add_structure_item(self, struct_type, parent=None, extra=None):
         if parent is None:
             parentptr = None
         else:
-            if not isinstance(parent, StructureItemId):
+            if __debug__ and not isinstance(parent, StructureItemId):
                 raise CapyPDFException('Parent argument must be a StructureItemID or None.')
-            parentptr = ctypes.pointer(parent)
+            parentptr = ctypes.byref(parent)
         if extra is None:
             extraptr = None
         else:
@@ -1001,9 +1194,9 @@ class Generator:
             extraptr = extra._as_parameter_
         stid = StructureItemId()
         if isinstance(struct_type, StructureType):
-            check_error(libfile.capy_generator_add_structure_item(self, struct_type.value, parentptr, extraptr, ctypes.pointer(stid)))
+            check_error(libfile.capy_generator_add_structure_item(self, struct_type.value, parentptr, extraptr, ctypes.byref(stid)))
         elif isinstance(struct_type, RoleId):
-            check_error(libfile.capy_generator_add_custom_structure_item(self, struct_type, parentptr, extraptr, ctypes.pointer(stid)))
+            check_error(libfile.capy_generator_add_custom_structure_item(self, struct_type, parentptr, extraptr, ctypes.byref(stid)))
         else:
             raise CapyPDFException('First argument must be a structure item or role id.')
         return stid
@@ -1014,7 +1207,7 @@ class Generator:
             raise CapyPDFException('Color argument must be a color object.')
         sepid = SeparationId()
         text_bytes = name.encode('UTF-8')
-        check_error(libfile.capy_generator_create_separation_simple(self, text_bytes, color, ctypes.pointer(sepid)))
+        check_error(libfile.capy_generator_create_separation_simple(self, text_bytes, color, ctypes.byref(sepid)))
         return sepid
 
     def write(self):
@@ -1025,33 +1218,41 @@ class Generator:
             raise CapyPDFException('Text must be a Unicode string.')
         if not isinstance(font, FontId):
             raise CapyPDFException('Font argument is not a font id.')
+        key = (font.id, pointsize, text)
+        try:
+            return self.width_cache[key]
+        except KeyError:
+            pass
         w = ctypes.c_double()
         bytes = text.encode('UTF-8')
-        check_error(libfile.capy_generator_text_width(self, bytes, font, pointsize, ctypes.pointer(w)))
+        check_error(libfile.capy_generator_text_width(self, bytes, font, pointsize, ctypes.byref(w)))
+        if len(self.width_cache) >= self.max_width_cache_size:
+            self.width_cache.clear()
+        self.width_cache[key] = w.value
         return w.value
 
     def add_graphics_state(self, gs):
         if not isinstance(gs, GraphicsState):
             raise CapyPDFException('Argument must be a graphics state object.')
         gsid = GraphicsStateId()
-        check_error(libfile.capy_generator_add_graphics_state(self, gs, ctypes.pointer(gsid)))
+        check_error(libfile.capy_generator_add_graphics_state(self, gs, ctypes.byref(gsid)))
         return gsid
 
     def add_outline(self, outline):
         if not isinstance(outline, Outline):
             raise CapyPDFException('Argument must be an outline object.')
         oid = OutlineId()
-        check_error(libfile.capy_generator_add_outline(self, outline, ctypes.pointer(oid)))
+        check_error(libfile.capy_generator_add_outline(self, outline, ctypes.byref(oid)))
         return oid
 
     def add_optional_content_group(self, ocg):
         ocgid = OptionalContentGroupId()
-        check_error(libfile.capy_generator_add_optional_content_group(self, ocg, ctypes.pointer(ocgid)))
+        check_error(libfile.capy_generator_add_optional_content_group(self, ocg, ctypes.byref(ocgid)))
         return ocgid
 
     def create_annotation(self, annotation):
         aid = AnnotationId()
-        check_error(libfile.capy_generator_create_annotation(self, annotation, ctypes.pointer(aid)))
+        check_error(libfile.capy_generator_create_annotation(self, annotation, ctypes.byref(aid)))
         return aid
 
     def add_rolemap_entry(self, name, builtin_type):
@@ -1059,26 +1260,38 @@ class Generator:
             raise CapyPDFException('Builtin type must be a StructureType.')
         roid = RoleId()
         name_bytes = name.encode('ASCII')
-        check_error(libfile.capy_generator_add_rolemap_entry(self, name_bytes, builtin_type.value, ctypes.pointer(roid)))
+        check_error(libfile.capy_generator_add_rolemap_entry(self, name_bytes, builtin_type.value, ctypes.byref(roid)))
         return roid
 
 
 class TextSequence:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self):
         opt = ctypes.c_void_p()
-        check_error(libfile.capy_text_sequence_new(ctypes.pointer(opt)))
+        check_error(libfile.capy_text_sequence_new(ctypes.byref(opt)))
         self._as_parameter_ = opt
 
     def __del__(self):
-        check_error(libfile.capy_text_sequence_destroy(self))
+        libfile.capy_text_sequence_destroy(self)
 
     def append_codepoint(self, codepoint):
         if not isinstance(codepoint, int):
             codepoint = ord(codepoint)
-        check_error(libfile.capy_text_sequence_append_codepoint(self, codepoint))
+        check_error(fastlib.capy_text_sequence_append_codepoint(self, codepoint))
+
+    def append_codepoints(self, text):
+        if isinstance(text, str):
+            # Native endian UTF-32 is the codepoint array, so the encoded
+            # bytes can be handed to C as is.
+            num_codepoints = len(text)
+            arr = text.encode(utf32_encoding)
+        else:
+            arr, num_codepoints = to_array(ctypes.c_uint32, text)
+        check_error(fastlib.capy_text_sequence_append_codepoints(self, arr, num_codepoints))
 
     def append_kerning(self, kern):
-        check_error(libfile.capy_text_sequence_append_kerning(self, kern))
+        check_error(fastlib.capy_text_sequence_append_kerning(self, kern))
 
     def append_actualtext_start(self, txt):
         check_error(libfile.capy_text_sequence_append_actualtext_start(self, txt.encode('UTF-8')))
@@ -1089,17 +1302,20 @@ class TextSequence:
     def append_raw_glyph(self, glyph_id, codepoint):
         if not isinstance(codepoint, int):
             codepoint = ord(codepoint)
-        check_error(libfile.capy_text_sequence_append_raw_glyph(self, glyph_id, codepoint))
+        check_error(fastlib.capy_text_sequence_append_raw_glyph(self, glyph_id, codepoint))
 
 class Text:
+    __slots__ = ('_as_parameter_', 'dc', 'matrix', '__weakref__')
+
     def __init__(self, dc):
         if not isinstance(dc, DrawContext):
             raise CapyPDFException('Argument must be a DrawingContext (preferably use its .text_new() method instead).')
         self._as_parameter_ = None
         opt = ctypes.c_void_p()
-        check_error(libfile.capy_dc_text_new(dc, ctypes.pointer(opt)))
+        check_error(libfile.capy_dc_text_new(dc, ctypes.byref(opt)))
         self._as_parameter_ = opt
         self.dc = dc
+        self.matrix = (ctypes.c_double * 6)()
 
     def __enter__(self):
         return self
@@ -1112,13 +1328,13 @@ class Text:
 
     def __del__(self):
         if self._as_parameter_ is not None:
-            check_error(libfile.capy_text_destroy(self))
+            libfile.capy_text_destroy(self)
 
     def render_text(self, text):
-        if not isinstance(text, str):
+        if __debug__ and not isinstance(text, str):
             raise CapyPDFException('Text must be a Unicode string.')
         bytes = text.encode('UTF-8')
-        check_error(libfile.capy_text_render_text(self, bytes))
+        check_error(fastlib.capy_text_render_text(self, bytes))
 
     def set_nonstroke(self, color):
         check_error(libfile.capy_text_set_nonstroke(self, color))
@@ -1137,12 +1353,12 @@ class Text:
         check_error(libfile.capy_text_cmd_Tc(self, spacing))
 
     def cmd_Td(self, x, y):
-        check_error(libfile.capy_text_cmd_Td(self, x, y))
+        check_error(fastlib.capy_text_cmd_Td(self, x, y))
 
     def cmd_Tf(self, fontid, ptsize):
-        if not isinstance(fontid, FontId):
+        if __debug__ and not isinstance(fontid, FontId):
             raise CapyPDFException('Font id is not a font object.')
-        check_error(libfile.capy_text_cmd_Tf(self, fontid, ptsize))
+        check_error(fastlib.capy_text_cmd_Tf(self, fontid, ptsize))
 
     def cmd_TL(self, leading):
         check_error(libfile.capy_text_cmd_TL(self, leading))
@@ -1150,13 +1366,15 @@ class Text:
     def cmd_TJ(self, seq):
         if not isinstance(seq, TextSequence):
             raise CapyPDFException('Argument must be a kerning sequence.')
-        check_error(libfile.capy_text_cmd_TJ(self, seq))
+        check_error(fastlib.capy_text_cmd_TJ(self, seq))
 
     def cmd_Tm(self, a, b, c, d, e, f):
-        check_error(libfile.capy_text_cmd_Tm(self, a, b, c, d, e, f))
+        m = self.matrix
+        m[:] = (a, b, c, d, e, f)
+        check_error(libfile.capy_text_cmd_Tm6(self, m))
 
     def cmd_Tr(self, rendtype):
-        if not isinstance(rendtype, TextMode):
+        if __debug__ and not isinstance(rendtype, TextMode):
             raise CapyPDFException('Argument must be a text mode.')
         check_error(libfile.capy_text_cmd_Tr(self, rendtype.value))
 
@@ -1166,16 +1384,56 @@ class Text:
     def cmd_Tstar(self):
         check_error(libfile.capy_text_cmd_Tstar(self))
 
+class ColorPool:
+    '''Keeps the C objects of deleted Colors for reuse.
+
+    Mesh shadings create large amounts of short lived colors. Reusing
+    their C objects replaces a new/destroy call pair with a reset. The
+    pooled c_void_p objects are handed out as is, so reuse does not
+    allocate a new pointer object either.'''
+
+    __slots__ = ('handles', 'max_size', '__weakref__')
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.handles = []
+
+    def get(self):
+        try:
+            cptr = self.handles.pop()
+        except IndexError:
+            cptr = ctypes.c_void_p()
+            check_error(libfile.capy_color_new(ctypes.byref(cptr)))
+            return cptr
+        check_error(libfile.capy_color_reset(cptr))
+        return cptr
+
+    def put(self, cptr):
+        if len(self.handles) < self.max_size:
+            self.handles.append(cptr)
+        else:
+            libfile.capy_color_destroy(cptr)
+
+    def drain(self):
+        '''Destroys the pooled C objects. Colors deleted after this are
+        destroyed directly.'''
+        self.max_size = 0
+        while self.handles:
+            libfile.capy_color_destroy(self.handles.pop())
+
+color_pool = ColorPool(1024)
+atexit.register(color_pool.drain)
+
 class Color:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self):
         self._as_parameter_ = None
-        opt = ctypes.c_void_p()
-        check_error(libfile.capy_color_new(ctypes.pointer(opt)))
-        self._as_parameter_ = opt
+        self._as_parameter_ = color_pool.get()
 
     def __del__(self):
         if self._as_parameter_ is not None:
-            check_error(libfile.capy_color_destroy(self))
+            color_pool.put(self._as_parameter_)
 
     def get_underlying(self):
         return self._as_parameter_
@@ -1190,6 +1448,8 @@ class Color:
         check_error(libfile.capy_color_set_cmyk(self, c, m, y, k))
 
     def set_icc(self, icc_id, values):
+        '''Values may be a list or any buffer, such as an array.array('d').
+        Buffers holding doubles are passed to C without conversion.'''
         check_error(libfile.capy_color_set_icc(self, icc_id, *to_array(ctypes.c_double, values)))
 
     def set_separation(self, sepid, value):
@@ -1202,76 +1462,94 @@ class Color:
         check_error(libfile.capy_color_set_lab(self, lab_id, l, a, b))
 
 class Transition:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, ttype, duration):
         self._as_parameter_ = None
         opt = ctypes.c_void_p()
         if not isinstance(ttype, TransitionType):
             raise CapyPDFException('Argument is not a transition type.')
-        check_error(libfile.capy_transition_new(ctypes.pointer(opt), ttype.value, duration))
+        check_error(libfile.capy_transition_new(ctypes.byref(opt), ttype.value, duration))
         self._as_parameter_ = opt
 
     def __del__(self):
-        check_error(libfile.capy_transition_destroy(self))
+        libfile.capy_transition_destroy(self)
 
 class RasterImage:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, cptr = None):
         if cptr is None:
             self._as_parameter_ = None
             opt = ctypes.c_void_p()
-            check_error(libfile.capy_raster_image_new(ctypes.pointer(opt)))
+            check_error(libfile.capy_raster_image_new(ctypes.byref(opt)))
             self._as_parameter_ = opt
         else:
             self._as_parameter_ = cptr
 
     def __del__(self):
-        check_error(libfile.capy_raster_image_destroy(self))
+        libfile.capy_raster_image_destroy(self)
 
     def get_colorspace(self):
         val = enum_type(99)
-        check_error(libfile.capy_raster_image_get_colorspace(self, ctypes.pointer(val)))
+        check_error(libfile.capy_raster_image_get_colorspace(self, ctypes.byref(val)))
         return ImageColorspace(val.value)
 
     def has_profile(self):
         val = ctypes.c_int32(99)
-        check_error(libfile.capy_raster_image_has_profile(self, ctypes.pointer(val)))
+        check_error(libfile.capy_raster_image_has_profile(self, ctypes.byref(val)))
         return True if val.value != 0 else False
 
 class RasterImageBuilder:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, cptr = None):
         if cptr is None:
             self._as_parameter_ = None
             opt = ctypes.c_void_p()
-            check_error(libfile.capy_raster_image_builder_new(ctypes.pointer(opt)))
+            check_error(libfile.capy_raster_image_builder_new(ctypes.byref(opt)))
             self._as_parameter_ = opt
         else:
             self._as_parameter_ = cptr
 
     def __del__(self):
-        check_error(libfile.capy_raster_image_builder_destroy(self))
+        libfile.capy_raster_image_builder_destroy(self)
 
     def set_size(self, w, h):
         check_error(libfile.capy_raster_image_builder_set_size(self, w, h))
 
     def set_pixel_data(self, pixels):
+        # Any bytes-like object is accepted. Writable contiguous buffers,
+        # such as bytearrays and NumPy arrays, are passed without a copy.
         if not isinstance(pixels, bytes):
-            raise CapyPDFException('Pixel data must be in bytes.')
+            try:
+                view = memoryview(pixels)
+            except TypeError:
+                raise CapyPDFException('Pixel data must be a bytes-like object.') from None
+            if view.readonly or not view.c_contiguous:
+                pixels = view.tobytes()
+            else:
+                view = view.cast('B')
+                pixels = array_type(ctypes.c_ubyte, len(view)).from_buffer(view)
         check_error(libfile.capy_raster_image_builder_set_pixel_data(self, pixels, len(pixels)))
 
     def build(self):
         opt = ctypes.c_void_p()
-        check_error(libfile.capy_raster_image_builder_build(self, ctypes.pointer(opt)))
+        check_error(libfile.capy_raster_image_builder_build(self, ctypes.byref(opt)))
         return RasterImage(opt)
 
 
 class GraphicsState:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self):
         self._as_parameter_ = None
         opt = ctypes.c_void_p()
-        check_error(libfile.capy_graphics_state_new(ctypes.pointer(opt)))
+        check_error(libfile.capy_graphics_state_new(ctypes.byref(opt)))
         self._as_parameter_ = opt
 
     def __del__(self):
-        check_error(libfile.capy_graphics_state_destroy(self))
+        libfile.capy_graphics_state_destroy(self)
 
     def set_CA(self, value):
         check_error(libfile.capy_graphics_state_set_CA(self, value))
@@ -1299,39 +1577,47 @@ class GraphicsState:
 
 
 class OptionalContentGroup:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, name):
         self._as_parameter_ = None
         in_bytes = name.encode('ASCII')
         opt = ctypes.c_void_p()
-        check_error(libfile.capy_optional_content_group_new(ctypes.pointer(opt), in_bytes))
+        check_error(libfile.capy_optional_content_group_new(ctypes.byref(opt), in_bytes))
         self._as_parameter_ = opt
 
     def __del__(self):
-        check_error(libfile.capy_optional_content_group_destroy(self))
+        libfile.capy_optional_content_group_destroy(self)
 
 class Type2Function:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, domain, c1, c2, n):
         self._as_parameter_ = None
         t2f = ctypes.c_void_p()
-        check_error(libfile.capy_type2_function_new(*to_array(ctypes.c_double, domain), c1, c2, n, ctypes.pointer(t2f)))
+        check_error(libfile.capy_type2_function_new(*to_array(ctypes.c_double, domain), c1, c2, n, ctypes.byref(t2f)))
         self._as_parameter_ = t2f
 
     def __del__(self):
-        check_error(libfile.capy_type2_function_destroy(self))
+        libfile.capy_type2_function_destroy(self)
 
 class Type2Shading:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, cs, x0, y0, x1, y1, funcid, extend1, extend2):
         e1 = 1 if extend1 else 0
         e2 = 1 if extend2 else 0
         self._as_parameter_ = None
         t2s = ctypes.c_void_p()
-        check_error(libfile.capy_type2_shading_new(cs.value, x0, y0, x1, y1, funcid, e1, e2, ctypes.pointer(t2s)))
+        check_error(libfile.capy_type2_shading_new(cs.value, x0, y0, x1, y1, funcid, e1, e2, ctypes.byref(t2s)))
         self._as_parameter_ = t2s
 
     def __del__(self):
-        check_error(libfile.capy_type2_shading_destroy(self))
+        libfile.capy_type2_shading_destroy(self)
 
 class Type3Shading:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, cs, coords, funcid, extend1, extend2):
         e1 = 1 if extend1 else 0
         e2 = 1 if extend2 else 0
@@ -1339,32 +1625,64 @@ class Type3Shading:
             raise CapyPDFException('Coords array must hold exactly 6 doubles.')
         self._as_parameter_ = None
         t3s = ctypes.c_void_p()
-        check_error(libfile.capy_type3_shading_new(cs.value, to_array(ctypes.c_double, coords)[0], funcid, e1, e2, ctypes.pointer(t3s)))
+        check_error(libfile.capy_type3_shading_new(cs.value, to_array(ctypes.c_double, coords)[0], funcid, e1, e2, ctypes.byref(t3s)))
         self._as_parameter_ = t3s
 
     def __del__(self):
-        check_error(libfile.capy_type3_shading_destroy(self))
+        libfile.capy_type3_shading_destroy(self)
 
 
 class Type4Shading:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, cs, minx, miny, maxx, maxy):
         t4s = ctypes.c_void_p()
         check_error(libfile.capy_type4_shading_new(cs.value,
-                    minx, miny, maxx, maxy, ctypes.pointer(t4s)))
+                    minx, miny, maxx, maxy, ctypes.byref(t4s)))
         self._as_parameter_ = t4s
 
     def __del__(self):
-        check_error(libfile.capy_type4_shading_destroy(self))
+        libfile.capy_type4_shading_destroy(self)
 
     def add_triangle(self, coords, colors):
         if len(coords) != 6:
             raise CapyPDFException('Must have exactly 6 floats.')
         if len(colors) != 3:
             raise CapyPDFException('Must have exactly 3 colors.')
-        colorptrs = [x.get_underlying() for x in colors]
         check_error(libfile.capy_type4_shading_add_triangle(self,
                     to_array(ctypes.c_double, coords)[0],
-                    to_array(ctypes.c_void_p, colorptrs)[0]))
+                    to_color_array(colors)))
+
+    def add_triangles(self, coords, colors):
+        '''Adds several unconnected triangles with a single call.
+
+        Coords must have 6 floats and colors 3 Color objects per triangle.'''
+        if len(colors) % 3 != 0:
+            raise CapyPDFException('Number of colors must be divisible by 3.')
+        num_triangles = len(colors) // 3
+        coordarr, num_coords = to_array(ctypes.c_double, coords)
+        if num_coords != 6 * num_triangles:
+            raise CapyPDFException('Must have exactly 6 floats per triangle.')
+        check_error(libfile.capy_type4_shading_add_triangles(self,
+                    coordarr,
+                    to_color_array(colors),
+                    num_triangles))
+
+    def add_triangles_rgb(self, coords, rgb):
+        '''Like add_triangles, but colors are given as 9 floats per
+        triangle rather than Color objects. Both arguments can be lists
+        or buffers such as NumPy float64 arrays.'''
+        coordarr, num_coords = to_array(ctypes.c_double, coords)
+        rgbarr, num_rgb = to_array(ctypes.c_double, rgb)
+        if num_coords % 6 != 0:
+            raise CapyPDFException('Must have exactly 6 floats per triangle.')
+        num_triangles = num_coords // 6
+        if num_rgb != 9 * num_triangles:
+            raise CapyPDFException('Must have exactly 9 color values per triangle.')
+        check_error(libfile.capy_type4_shading_add_triangles_rgb(self,
+                    coordarr,
+                    rgbarr,
+                    num_triangles))
 
     def extend(self, flag, coords, color):
         if flag == 1 or flag == 2:
@@ -1381,24 +1699,40 @@ class Type4Shading:
 
 
 class Type6Shading:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, cs, minx, miny, maxx, maxy):
         t6s = ctypes.c_void_p()
         check_error(libfile.capy_type6_shading_new(cs.value,
-                    minx, miny, maxx, maxy, ctypes.pointer(t6s)))
+                    minx, miny, maxx, maxy, ctypes.byref(t6s)))
         self._as_parameter_ = t6s
 
     def __del__(self):
-        check_error(libfile.capy_type6_shading_destroy(self))
+        libfile.capy_type6_shading_destroy(self)
 
     def add_patch(self, coords, colors):
         if len(coords) != 24:
             raise CapyPDFException('Must have exactly 24 floats.')
         if len(colors) != 4:
             raise CapyPDFException('Must have exactly 4 colors.')
-        colorptrs = [x.get_underlying() for x in colors]
         check_error(libfile.capy_type6_shading_add_patch(self,
                     to_array(ctypes.c_double, coords)[0],
-                    to_array(ctypes.c_void_p, colorptrs)[0]))
+                    to_color_array(colors)))
+
+    def add_patches(self, coords, colors):
+        '''Adds several patches with a single call.
+
+        Coords must have 24 floats and colors 4 Color objects per patch.'''
+        if len(colors) % 4 != 0:
+            raise CapyPDFException('Number of colors must be divisible by 4.')
+        num_patches = len(colors) // 4
+        coordarr, num_coords = to_array(ctypes.c_double, coords)
+        if num_coords != 24 * num_patches:
+            raise CapyPDFException('Must have exactly 24 floats per patch.')
+        check_error(libfile.capy_type6_shading_add_patches(self,
+                    coordarr,
+                    to_color_array(colors),
+                    num_patches))
 
     def extend(self, flag, coords, colors):
         if flag == 1 or flag == 2 or flag == 3:
@@ -1406,20 +1740,21 @@ class Type6Shading:
                 raise CapyPDFException('Must have exactly 16 floats.')
             if len(colors) != 2:
                 raise CapyPDFException('Must have exactly 2 colors.')
-            colorptrs = [x.get_underlying() for x in colors]
             check_error(libfile.capy_type6_shading_extend(self,
                         flag,
                         to_array(ctypes.c_double, coords)[0],
-                        to_array(ctypes.c_void_p, colorptrs)[0]))
+                        to_color_array(colors)))
         else:
             raise CapyPDFException(f'Bad flag value {flag}')
 
 class Annotation:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self, handle):
         self._as_parameter_ = handle
 
     def __del__(self):
-        check_error(libfile.capy_annotation_destroy(self))
+        libfile.capy_annotation_destroy(self)
 
     def set_rectangle(self, x1, y1, x2, y2):
         check_error(libfile.capy_annotation_set_rectangle(self, x1, y1, x2, y2))
@@ -1432,29 +1767,31 @@ class Annotation:
     @classmethod
     def new_text_annotation(cls, text):
         ta = ctypes.c_void_p()
-        check_error(libfile.capy_text_annotation_new(text.encode('utf-8'), ctypes.pointer(ta)))
+        check_error(libfile.capy_text_annotation_new(text.encode('utf-8'), ctypes.byref(ta)))
         return Annotation(ta)
 
     @classmethod
     def new_file_attachment_annotation(cls, fid):
         ta = ctypes.c_void_p()
-        check_error(libfile.capy_file_attachment_annotation_new(fid, ctypes.pointer(ta)))
+        check_error(libfile.capy_file_attachment_annotation_new(fid, ctypes.byref(ta)))
         return Annotation(ta)
 
     @classmethod
     def new_printers_mark_annotation(cls, fid):
         ta = ctypes.c_void_p()
-        check_error(libfile.capy_printers_mark_annotation_new(fid, ctypes.pointer(ta)))
+        check_error(libfile.capy_printers_mark_annotation_new(fid, ctypes.byref(ta)))
         return Annotation(ta)
 
 class StructItemExtraData:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self):
         ed = ctypes.c_void_p()
-        check_error(libfile.capy_struct_item_extra_data_new(ctypes.pointer(ed)))
+        check_error(libfile.capy_struct_item_extra_data_new(ctypes.byref(ed)))
         self._as_parameter_ = ed
 
     def __del__(self):
-        check_error(libfile.capy_struct_item_extra_data_destroy(self))
+        libfile.capy_struct_item_extra_data_destroy(self)
 
     def set_t(self, T):
         chars = T.encode('UTF-8')
@@ -1473,13 +1810,15 @@ class StructItemExtraData:
         check_error(libfile.capy_struct_item_extra_data_set_actual_text(self, chars))
 
 class ImagePdfProperties:
+    __slots__ = ('_as_parameter_', '__weakref__')
+
     def __init__(self):
         ed = ctypes.c_void_p()
-        check_error(libfile.capy_image_pdf_properties_new(ctypes.pointer(ed)))
+        check_error(libfile.capy_image_pdf_properties_new(ctypes.byref(ed)))
         self._as_parameter_ = ed
 
     def __del__(self):
-        check_error(libfile.capy_image_pdf_properties_destroy(self))
+        libfile.capy_image_pdf_properties_destroy(self)
 
     def set_mask(self, boolval):
         intval = 1 if boolval else 0
@@ -1488,41 +1827,53 @@ class ImagePdfProperties:
     def set_interpolate(self, ival):
         if not isinstance(ival, ImageInterpolation):
             raise CapyPDFException('Argument must be image interpolation enum.')
-        check_error(libfile.capy_image_lpdf_properties_set_interpolate(self, ival.value))
+        check_error(libfile.capy_image_pdf_properties_set_interpolate(self, ival.value))
 
 class Destination:
+    __slots__ = ('_as_parameter_', 'xyz', '__weakref__')
+
     def __init__(self):
         d = ctypes.c_void_p()
-        check_error(libfile.capy_destination_new(ctypes.pointer(d)))
+        check_error(libfile.capy_destination_new(ctypes.byref(d)))
         self._as_parameter_ = d
+        self.xyz = (ctypes.c_double * 3)()
 
     def __del__(self):
-        check_error(libfile.capy_destination_destroy(self))
+        libfile.capy_destination_destroy(self)
 
     def set_page(self, page_num):
-        check_error(libfile.capy_destination_set_page(self, page_num))
+        check_error(fastlib.capy_destination_set_page(self, page_num))
 
     def set_xyz(self, x=None, y=None, z=None):
-        xptr = self.double_to_cptr(x)
-        yptr = self.double_to_cptr(y)
-        zptr = self.double_to_cptr(z)
-        check_error(libfile.capy_destination_set_xyz(self, xptr, yptr, zptr))
-
-    def double_to_cptr(self, value):
-        if value is None:
-            return None
-        d = ctypes.c_double(value)
-        cptr = ctypes.pointer(d)
-        return cptr
+        # Passed as one array and a bit mask of the values that are set.
+        # The array is reused between calls.
+        values = self.xyz
+        mask = 0
+        if x is not None:
+            values[0] = x
+            mask |= 1
+        if y is not None:
+            values[1] = y
+            mask |= 2
+        if z is not None:
+            values[2] = z
+            mask |= 4
+        check_error(libfile.capy_destination_set_xyz_packed(self, values, mask))
 
 class Outline:
+    __slots__ = ('_as_parameter_', 'rgb', 'f', '__weakref__')
+
     def __init__(self):
         o = ctypes.c_void_p()
-        check_error(libfile.capy_outline_new(ctypes.pointer(o)))
+        check_error(libfile.capy_outline_new(ctypes.byref(o)))
         self._as_parameter_ = o
+        # Values currently set on the C object, used to skip calls that
+        # would not change anything. Color has no default, F is 0.
+        self.rgb = None
+        self.f = 0
 
     def __del__(self):
-        check_error(libfile.capy_outline_destroy(self))
+        libfile.capy_outline_destroy(self)
 
     def set_title(self, title):
         ctitle = title.encode('UTF-8')
@@ -1533,13 +1884,29 @@ class Outline:
             raise CapyPDFException('Argument must be a destination object.')
         check_error(libfile.capy_outline_set_destination(self, dest))
 
+    def set_destination_unchecked(self, dest):
+        '''Same as set_destination but without the type check, for loops
+        that add many outlines. Nothing is validated: None reaches the C
+        function as a NULL pointer and an integer or a foreign object with
+        an _as_parameter_ as whatever address it holds. Both crash or
+        corrupt memory rather than raising an exception.'''
+        check_error(libfile.capy_outline_set_destination(self, dest))
+
     def set_rgb(self, r, g, b):
-        check_error(libfile.capy_outline_set_rgb(self, r, g, b))
+        rgb = (r, g, b)
+        if rgb == self.rgb:
+            return
+        check_error(fastlib.capy_outline_set_rgb(self, r, g, b))
+        self.rgb = rgb
 
     def set_f(self, f):
-        check_error(libfile.capy_outline_set_f(self, f))
+        if f == self.f:
+            return
+        check_error(fastlib.capy_outline_set_f(self, f))
+        self.f = f
 
     def set_parent(self, parent):
-        if not isinstance(parent, OutlineId):
+        # ctypes rejects other types on its own.
+        if __debug__ and not isinstance(parent, OutlineId):
             raise CapyPDFException('Argument must be a parent id.')
         check_error(libfile.capy_outline_set_parent(self, parent))
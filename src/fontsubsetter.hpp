@@ -32,10 +32,10 @@ struct FontSubsetData {
 
 class FontSubsetter {
 public:
-    static rvoe<FontSubsetter> construct(const std::filesystem::path &fontfile, FT_Face face);
+    static rvoe<FontSubsetter> construct(TrueTypeFontFile ttfile, FT_Face face);
 
     FontSubsetter(TrueTypeFontFile ttfile, FT_Face face, std::vector<FontSubsetData> subsets)
-        : ttfile{ttfile}, face{face}, subsets{subsets} {}
+        : ttfile{std::move(ttfile)}, face{face}, subsets{std::move(subsets)} {}
 
     rvoe<FontSubsetInfo> get_glyph_subset(uint32_t glyph, const std::optional<uint32_t> glyph_id);
     rvoe<FontSubsetInfo>
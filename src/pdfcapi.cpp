@@ -621,6 +621,12 @@ CAPYPDF_PUBLIC CapyPDF_EC capy_dc_cmd_cm(CapyPDF_DrawContext *ctx,
     return conv_err(dc->cmd_cm(m1, m2, m3, m4, m5, m6));
 }
 
+CAPYPDF_PUBLIC CapyPDF_EC capy_dc_cmd_cm6(CapyPDF_DrawContext *ctx,
+                                          const double *m) CAPYPDF_NOEXCEPT {
+    auto dc = reinterpret_cast<PdfDrawContext *>(ctx);
+    return conv_err(dc->cmd_cm(m[0], m[1], m[2], m[3], m[4], m[5]));
+}
+
 CAPYPDF_PUBLIC CapyPDF_EC capy_dc_cmd_d(CapyPDF_DrawContext *ctx,
                                         double *dash_array,
                                         int32_t array_size,
@@ -796,6 +802,75 @@ CAPYPDF_PUBLIC CapyPDF_EC capy_dc_cmd_y(
     return conv_err(c->cmd_y(x1, y1, x3, y3));
 }
 
+static int32_t path_op_arg_count(uint8_t op) {
+    switch(op) {
+    case CAPY_PATH_OP_M:
+    case CAPY_PATH_OP_L:
+        return 2;
+    case CAPY_PATH_OP_C:
+        return 6;
+    case CAPY_PATH_OP_V:
+    case CAPY_PATH_OP_Y:
+    case CAPY_PATH_OP_RE:
+        return 4;
+    case CAPY_PATH_OP_H:
+        return 0;
+    default:
+        return -1;
+    }
+}
+
+CAPYPDF_PUBLIC CapyPDF_EC capy_dc_run_path_ops(CapyPDF_DrawContext *ctx,
+                                               const uint8_t *ops,
+                                               int32_t num_ops,
+                                               const double *coords,
+                                               int32_t num_coords) CAPYPDF_NOEXCEPT {
+    auto c = reinterpret_cast<PdfDrawContext *>(ctx);
+    if(num_ops < 0 || num_coords < 0) {
+        return conv_err(ErrorCode::IndexIsNegative);
+    }
+    const double *p = coords;
+    const double *end = coords + num_coords;
+    for(int32_t i = 0; i < num_ops; ++i) {
+        const auto arg_count = path_op_arg_count(ops[i]);
+        if(arg_count < 0) {
+            return conv_err(ErrorCode::BadEnum);
+        }
+        if(end - p < arg_count) {
+            return conv_err(ErrorCode::IndexOutOfBounds);
+        }
+        rvoe<NoReturnValue> rc;
+        switch(ops[i]) {
+        case CAPY_PATH_OP_M:
+            rc = c->cmd_m(p[0], p[1]);
+            break;
+        case CAPY_PATH_OP_L:
+            rc = c->cmd_l(p[0], p[1]);
+            break;
+        case CAPY_PATH_OP_C:
+            rc = c->cmd_c(p[0], p[1], p[2], p[3], p[4], p[5]);
+            break;
+        case CAPY_PATH_OP_V:
+            rc = c->cmd_v(p[0], p[1], p[2], p[3]);
+            break;
+        case CAPY_PATH_OP_Y:
+            rc = c->cmd_y(p[0], p[1], p[2], p[3]);
+            break;
+        case CAPY_PATH_OP_RE:
+            rc = c->cmd_re(p[0], p[1], p[2], p[3]);
+            break;
+        case CAPY_PATH_OP_H:
+            rc = c->cmd_h();
+            break;
+        }
+        if(!rc) {
+            return conv_err(rc);
+        }
+        p += arg_count;
+    }
+    RETNOERR;
+}
+
 CAPYPDF_PUBLIC CapyPDF_EC capy_dc_set_stroke(CapyPDF_DrawContext *ctx,
                                              CapyPDF_Color *c) CAPYPDF_NOEXCEPT {
     auto *dc = reinterpret_cast<PdfDrawContext *>(ctx);
@@ -918,6 +993,23 @@ CAPYPDF_PUBLIC CapyPDF_EC capy_text_sequence_append_codepoint(CapyPDF_TextSequen
     return conv_err(rc);
 }
 
+CAPYPDF_PUBLIC CapyPDF_EC capy_text_sequence_append_codepoints(CapyPDF_TextSequence *tseq,
+                                                               const uint32_t *codepoints,
+                                                               int32_t num_codepoints)
+    CAPYPDF_NOEXCEPT {
+    auto *ts = reinterpret_cast<TextSequence *>(tseq);
+    if(num_codepoints < 0) {
+        return conv_err(ErrorCode::IndexIsNegative);
+    }
+    for(int32_t i = 0; i < num_codepoints; ++i) {
+        auto rc = ts->append_unicode(codepoints[i]);
+        if(!rc) {
+            return conv_err(rc);
+        }
+    }
+    RETNOERR;
+}
+
 CAPYPDF_PUBLIC CapyPDF_EC capy_text_sequence_append_kerning(CapyPDF_TextSequence *tseq,
                                                             double kern) CAPYPDF_NOEXCEPT {
     auto *ts = reinterpret_cast<TextSequence *>(tseq);
@@ -1035,6 +1127,12 @@ CAPYPDF_PUBLIC CapyPDF_EC capy_text_cmd_Tm(CapyPDF_Text *text,
     return conv_err(t->cmd_Tm(a, b, c, d, e, f));
 }
 
+CAPYPDF_PUBLIC CapyPDF_EC capy_text_cmd_Tm6(CapyPDF_Text *text,
+                                            const double *m) CAPYPDF_NOEXCEPT {
+    auto *t = reinterpret_cast<PdfText *>(text);
+    return conv_err(t->cmd_Tm(m[0], m[1], m[2], m[3], m[4], m[5]));
+}
+
 CAPYPDF_PUBLIC CapyPDF_EC capy_text_cmd_Tr(CapyPDF_Text *text,
                                            CapyPDF_Text_Mode tmode) CAPYPDF_NOEXCEPT {
     auto *t = reinterpret_cast<PdfText *>(text);
@@ -1066,6 +1164,11 @@ CAPYPDF_PUBLIC CapyPDF_EC capy_color_destroy(CapyPDF_Color *color) CAPYPDF_NOEXC
     RETNOERR;
 }
 
+CAPYPDF_PUBLIC CapyPDF_EC capy_color_reset(CapyPDF_Color *color) CAPYPDF_NOEXCEPT {
+    *reinterpret_cast<capypdf::Color *>(color) = DeviceRGBColor{0, 0, 0};
+    RETNOERR;
+}
+
 CAPYPDF_PUBLIC CapyPDF_EC capy_color_set_rgb(CapyPDF_Color *c, double r, double g, double b)
     CAPYPDF_NOEXCEPT {
     *reinterpret_cast<capypdf::Color *>(c) = DeviceRGBColor{r, g, b};
@@ -1392,6 +1495,50 @@ CAPYPDF_PUBLIC CapyPDF_EC capy_type4_shading_add_triangle(CapyPDF_Type4Shading *
     RETNOERR;
 }
 
+CAPYPDF_PUBLIC CapyPDF_EC capy_type4_shading_add_triangles(CapyPDF_Type4Shading *shade,
+                                                           const double *coords,
+                                                           const CapyPDF_Color **colors,
+                                                           int32_t num_triangles)
+    CAPYPDF_NOEXCEPT {
+    auto *sh = reinterpret_cast<ShadingType4 *>(shade);
+    auto *cc = reinterpret_cast<const Color **>(colors);
+    if(num_triangles < 0) {
+        return conv_err(ErrorCode::IndexIsNegative);
+    }
+    for(int32_t i = 0; i < num_triangles; ++i) {
+        const double *tc = coords + 6 * i;
+        const Color **tcc = cc + 3 * i;
+        ShadingPoint sp1 = conv_shpoint(tc, tcc[0]);
+        ShadingPoint sp2 = conv_shpoint(tc + 2, tcc[1]);
+        ShadingPoint sp3 = conv_shpoint(tc + 4, tcc[2]);
+        sh->start_strip(sp1, sp2, sp3);
+    }
+    RETNOERR;
+}
+
+CAPYPDF_PUBLIC CapyPDF_EC capy_type4_shading_add_triangles_rgb(CapyPDF_Type4Shading *shade,
+                                                               const double *coords,
+                                                               const double *rgb,
+                                                               int32_t num_triangles)
+    CAPYPDF_NOEXCEPT {
+    auto *sh = reinterpret_cast<ShadingType4 *>(shade);
+    if(num_triangles < 0) {
+        return conv_err(ErrorCode::IndexIsNegative);
+    }
+    ShadingPoint sp[3];
+    for(int32_t i = 0; i < num_triangles; ++i) {
+        for(int j = 0; j < 3; ++j) {
+            const double *pc = coords + 6 * i + 2 * j;
+            const double *cc = rgb + 9 * i + 3 * j;
+            sp[j].p.x = pc[0];
+            sp[j].p.y = pc[1];
+            sp[j].c = DeviceRGBColor{cc[0], cc[1], cc[2]};
+        }
+        sh->start_strip(sp[0], sp[1], sp[2]);
+    }
+    RETNOERR;
+}
+
 CAPYPDF_PUBLIC CapyPDF_EC capy_type4_shading_extend(CapyPDF_Type4Shading *shade,
                                                     int32_t flag,
                                                     const double *coords,
@@ -1454,6 +1601,23 @@ CAPYPDF_PUBLIC CapyPDF_EC capy_type6_shading_add_patch(CapyPDF_Type6Shading *sha
     RETNOERR;
 }
 
+CAPYPDF_PUBLIC CapyPDF_EC capy_type6_shading_add_patches(CapyPDF_Type6Shading *shade,
+                                                         const double *coords,
+                                                         const CapyPDF_Color **colors,
+                                                         int32_t num_patches) CAPYPDF_NOEXCEPT {
+    auto *sh = reinterpret_cast<ShadingType6 *>(shade);
+    auto **cc = reinterpret_cast<const Color **>(colors);
+    if(num_patches < 0) {
+        return conv_err(ErrorCode::IndexIsNegative);
+    }
+    for(int32_t i = 0; i < num_patches; ++i) {
+        FullCoonsPatch cp;
+        grab_coons_data(cp, coords + 24 * i, cc + 4 * i);
+        sh->elements.emplace_back(std::move(cp));
+    }
+    RETNOERR;
+}
+
 CAPYPDF_PUBLIC CapyPDF_EC capy_type6_shading_extend(CapyPDF_Type6Shading *shade,
                                                     int32_t flag,
                                                     const double *coords,
@@ -1640,6 +1804,26 @@ CAPYPDF_PUBLIC CapyPDF_EC capy_destination_set_xyz(CapyPDF_Destination *dest,
     RETNOERR;
 }
 
+CAPYPDF_PUBLIC CapyPDF_EC capy_destination_set_xyz_packed(CapyPDF_Destination *dest,
+                                                          const double *xyz,
+                                                          uint32_t mask) CAPYPDF_NOEXCEPT {
+    auto *d = reinterpret_cast<Destination *>(dest);
+    if(mask & ~uint32_t(7)) {
+        return conv_err(ErrorCode::BadEnum);
+    }
+    d->loc = XYZDestination{};
+    if(mask & 1) {
+        d->loc.x = xyz[0];
+    }
+    if(mask & 2) {
+        d->loc.y = xyz[1];
+    }
+    if(mask & 4) {
+        d->loc.z = xyz[2];
+    }
+    RETNOERR;
+}
+
 CAPYPDF_PUBLIC CapyPDF_EC capy_destination_destroy(CapyPDF_Destination *dest) CAPYPDF_NOEXCEPT {
     delete reinterpret_cast<Destination *>(dest);
     RETNOERR;
@@ -1522,7 +1522,9 @@ rvoe<CapyPDF_FontId> PdfDocument::load_font(FT_Library ft, const std::filesystem
         RETERR(UnsupportedFormat);
     }
     auto font_source_id = fonts.size();
-    ERC(fss, FontSubsetter::construct(fname, face));
+    // The subsetter gets a copy of the already parsed font rather than
+    // reading and parsing the file a second time.
+    ERC(fss, FontSubsetter::construct(ttf.fontdata, face));
     fonts.emplace_back(FontThingy{std::move(ttf), std::move(fss)});
 
     const int32_t subset_num = 0;
@@ -5,11 +5,20 @@
 
 
 import unittest
-import os, sys, pathlib, shutil, subprocess
+import os, sys, pathlib, shutil, subprocess, io, hashlib, functools, re, array, weakref, math, ctypes, zlib
+import concurrent.futures
 import PIL.Image, PIL.ImageChops
-
-if shutil.which('gs') is None:
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# The full path is exported so that test worker processes inherit it and
+# no subprocess call has to search PATH for Ghostscript.
+gs_exe = os.environ.get('CAPYPDF_GS_EXE') or shutil.which('gs')
+if gs_exe is None:
     sys.exit('Ghostscript not found, test suite can not be run.')
+os.environ['CAPYPDF_GS_EXE'] = gs_exe
 
 os.environ['CAPYPDF_SO_OVERRIDE'] = 'src' # Sucks, but there does not seem to be a better injection point.
 source_root = pathlib.Path(__file__).parent.parent
@@ -18,9 +27,20 @@ image_dir = source_root / 'images'
 icc_dir = source_root / 'icc'
 sys.path.append(str(source_root / 'python'))
 
-noto_fontdir = pathlib.Path('/usr/share/fonts/truetype/noto')
-
-sys.argv = sys.argv[0:1] + sys.argv[2:]
+def find_noto_fontdir():
+    # Debian and Ubuntu install Noto here. Elsewhere ask fontconfig, but
+    # only accept the exact files the reference images were made with.
+    default_dir = pathlib.Path('/usr/share/fonts/truetype/noto')
+    if (default_dir / 'NotoSans-Regular.ttf').exists() or shutil.which('fc-match') is None:
+        return default_dir
+    found = subprocess.run(['fc-match', '-f', '%{file}', 'Noto Sans:style=Regular'],
+                           capture_output=True,
+                           text=True).stdout
+    if found.endswith('/NotoSans-Regular.ttf'):
+        return pathlib.Path(found).parent
+    return default_dir
+
+noto_fontdir = find_noto_fontdir()
 
 import capypdf
 
@@ -32,8 +52,67 @@ def draw_intersect_shape(ctx):
     ctx.cmd_l(20, 10)
     ctx.cmd_h()
 
-def validate_image(basename, w, h):
-    import functools
+# The oracle caches are keyed on the modification time so that an
+# updated reference image is picked up by the next lookup.
+@functools.lru_cache(maxsize=None)
+def oracle_digest(path, mtime):
+    return hashlib.sha256(path.read_bytes()).digest()
+
+@functools.lru_cache(maxsize=64)
+def oracle_image(path, mtime):
+    image = PIL.Image.open(path, formats=['PNG'])
+    image.load()
+    return image
+
+# Setting CAPYPDF_TESTCACHE to a directory stores the rendered images
+# there, so that unchanged PDFs are not rendered again on the next run.
+# The date strings and the random document ID are masked out of the key,
+# as they differ on every run.
+render_cache_dir = os.environ.get('CAPYPDF_TESTCACHE')
+volatile_pdf_data = re.compile(rb'\(D:\d{14}Z\)|/ID \[<[0-9A-F]+><[0-9A-F]+>\]')
+
+@functools.cache
+def gs_version():
+    return subprocess.run([gs_exe, '--version'], capture_output=True).stdout.strip()
+
+def render_pdf(utobj, pdfname, w, h):
+    if render_cache_dir is None:
+        return run_gs(utobj, pdfname, w, h)
+    key = hashlib.blake2b(volatile_pdf_data.sub(b'', pdfname.read_bytes()), digest_size=16)
+    key.update(gs_version())
+    cached = pathlib.Path(render_cache_dir) / f'{key.hexdigest()}_{w}x{h}.png'
+    if cached.exists():
+        return cached.read_bytes()
+    png_data = run_gs(utobj, pdfname, w, h)
+    cached.parent.mkdir(parents=True, exist_ok=True)
+    cached.write_bytes(png_data)
+    return png_data
+
+def run_gs(utobj, pdfname, w, h):
+    # The PNG is read from stdout, so it never touches the disk.
+    # Messages are redirected to stderr and captured so that
+    # renders in parallel test processes do not interleave. Not closing
+    # file descriptors lets Python start gs with posix_spawn.
+    gs = subprocess.run([gs_exe,
+                         '-q',
+                         '-dNOPAUSE',
+                         '-dBATCH',
+                         '-sDEVICE=png16m',
+                         f'-g{w}x{h}',
+                         #'-dPDFFitPage',
+                         '-sstdout=%stderr',
+                         '-sOutputFile=-',
+                         str(pdfname)],
+                        stdin=subprocess.DEVNULL,
+                        capture_output=True,
+                        close_fds=False)
+    utobj.assertEqual(gs.returncode, 0, gs.stderr.decode(errors='replace'))
+    return gs.stdout
+
+def validate_image(basename, w, h, oracle=None):
+    # Tests that draw the same page in a different way compare against
+    # the reference image of the original test with the oracle argument.
+    # Their own basename keeps the output files of parallel tests apart.
     def decorator_validate(func):
         @functools.wraps(func)
         def wrapper_validate(*args, **kwargs):
@@ -42,33 +121,59 @@ def validate_image(basename, w, h):
             pngname = pathlib.Path(basename + '.png')
             pdfname = pathlib.Path(basename + '.pdf')
             args = (args[0], pdfname, w, h)
-            try:
-                pdfname.unlink()
-            except Exception:
-                pass
-            utobj.assertFalse(os.path.exists(pdfname), 'PDF file already exists.')
+            pdfname.unlink(missing_ok=True)
             value = func(*args, **kwargs)
-            the_truth = testdata_dir / pngname
+            the_truth = testdata_dir / ((oracle or basename) + '.png')
             utobj.assertTrue(os.path.exists(pdfname), 'Test did not generate a PDF file.')
-            utobj.assertEqual(subprocess.run(['gs',
-                                              '-q',
-                                              '-dNOPAUSE',
-                                              '-dBATCH',
-                                              '-sDEVICE=png16m',
-                                              f'-g{w}x{h}',
-                                              #'-dPDFFitPage',
-                                              f'-sOutputFile={pngname}',
-                                              str(pdfname)]).returncode, 0)
-            oracle_image = PIL.Image.open(the_truth)
-            gen_image = PIL.Image.open(pngname)
-            diff = PIL.ImageChops.difference(oracle_image, gen_image)
-            utobj.assertFalse(diff.getbbox(), 'Rendered image is different.')
+            png_data = render_pdf(utobj, pdfname, w, h)
+            # Identical files need no decoding. Otherwise the pixels are
+            # compared, as the PNG encoding can differ between gs versions.
+            mtime = the_truth.stat().st_mtime_ns
+            if hashlib.sha256(png_data).digest() != oracle_digest(the_truth, mtime):
+                compare_images(utobj, the_truth, pngname, png_data)
             pdfname.unlink()
-            pngname.unlink()
             return value
         return wrapper_validate
     return decorator_validate
 
+def compare_images(utobj, the_truth, pngname, png_data):
+    message = image_mismatch(the_truth, png_data)
+    if message is not None:
+        # Like the PDF, the rendered image is left in place on failure
+        # so that it can be inspected.
+        pngname.write_bytes(png_data)
+        utobj.fail(message)
+
+def image_mismatch(the_truth, png_data):
+    truth_image = oracle_image(the_truth, the_truth.stat().st_mtime_ns)
+    try:
+        gen_image = PIL.Image.open(io.BytesIO(png_data), formats=['PNG'])
+        gen_image.load()
+    except (PIL.UnidentifiedImageError, OSError) as e:
+        return f'Could not decode rendered image: {e}'
+    # Comparing the raw pixel bytes is a single memcmp, whereas
+    # computing a difference image needs a full extra image.
+    if truth_image.mode != gen_image.mode:
+        return f'Rendered image has wrong mode {gen_image.mode}, expected {truth_image.mode}.'
+    if truth_image.size != gen_image.size:
+        return f'Rendered image has wrong size {gen_image.size}, expected {truth_image.size}.'
+    if truth_image.tobytes() != gen_image.tobytes():
+        # Only build the difference image when it is needed for the message.
+        bbox = PIL.ImageChops.difference(truth_image, gen_image).getbbox()
+        return f'Rendered image is different in area {bbox}.'
+    return None
+
+def page_streams(pdf):
+    # Concatenation of all streams that inflate, for checking the
+    # operators written to compressed page contents.
+    streams = []
+    for m in re.finditer(rb'stream\n(.*?)endstream\n', pdf, re.DOTALL):
+        try:
+            streams.append(zlib.decompressobj().decompress(m.group(1)))
+        except zlib.error:
+            pass
+    return b''.join(streams)
+
 def cleanup(ofilename):
     import functools
     def decorator_validate(func):
@@ -93,10 +198,51 @@ sh6_coords = [50, 50,
               150, 50,
               150 - 15, 50 - 15,
               50 + 20, 50 + 20]
-sh6_coords = [x/2 for x in sh6_coords]
+# Stored as doubles so that every use passes the buffer to C as is.
+sh6_coords = array.array('d', (x/2 for x in sh6_coords))
+
+def draw_shading_quadrants(ctx, sh2id, sh3id, sh4id, sh6id):
+    for tx, ty, shid in ((0, 0, sh2id), (100, 0, sh3id), (0, 100, sh4id)):
+        with ctx.push_gstate():
+            if tx or ty:
+                ctx.translate(tx, ty)
+            ctx.cmd_re(10, 10, 80, 80)
+            ctx.cmd_Wstar()
+            ctx.cmd_n()
+            ctx.cmd_sh(shid)
+    with ctx.push_gstate():
+        ctx.translate(100, 100)
+        ctx.cmd_re(0, 0, 100, 100)
+        ctx.cmd_Wstar()
+        ctx.cmd_n()
+        ctx.cmd_sh(sh6id)
 
 class TestPDFCreation(unittest.TestCase):
 
+    @classmethod
+    def setUpClass(cls):
+        cls.options_cache = {}
+
+    def page_options(self, w, h, colorspace=None, device_profile=None):
+        # Generators copy their options, so tests that need nothing
+        # beyond the page size and output colorspace can share one
+        # object per combination. Do not modify the returned object.
+        key = (w, h, colorspace, device_profile)
+        try:
+            return self.options_cache[key]
+        except KeyError:
+            pass
+        props = capypdf.PageProperties()
+        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
+        opts = capypdf.Options()
+        opts.set_default_page_properties(props)
+        if colorspace is not None:
+            opts.set_colorspace(colorspace)
+        if device_profile is not None:
+            opts.set_device_profile(colorspace, icc_dir / device_profile)
+        self.options_cache[key] = opts
+        return opts
+
     @validate_image('python_simple', 480, 640)
     def test_simple(self, ofilename, w, h):
         ofile = pathlib.Path(ofilename)
@@ -142,10 +288,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_image', 200, 200)
     def test_images(self, ofilename, w, h):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             params = capypdf.ImagePdfProperties()
             bg_img = g.embed_jpg(image_dir / 'simple.jpg')
@@ -176,10 +319,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_path', 200, 200)
     def test_path(self, ofilename, w, h):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             with g.page_draw_context() as ctx:
                 with ctx.push_gstate():
@@ -215,12 +355,170 @@ class TestPDFCreation(unittest.TestCase):
                     draw_intersect_shape(ctx)
                     ctx.cmd_Bstar()
 
+    # Same output as test_path. The triangle is drawn upside down and
+    # turned back with a half rotation. The matrix is given directly, as
+    # rotate() would add rounding noise to the exact pixel edges.
+    @validate_image('python_path_rotate', 200, 200, oracle='python_path')
+    def test_path_rotate(self, ofilename, w, h):
+        opts = self.page_options(w, h)
+        with capypdf.Generator(ofilename, opts) as g:
+            with g.page_draw_context() as ctx:
+                with ctx.push_gstate():
+                    ctx.cmd_w(5)
+                    ctx.cmd_J(capypdf.LineCapStyle.Round)
+                    ctx.cmd_m(10, 10);
+                    ctx.cmd_c(80, 10, 20, 90, 90, 90);
+                    ctx.cmd_S();
+                with ctx.push_gstate():
+                    ctx.cmd_w(10)
+                    ctx.cmd_cm(-1, 0, 0, -1, 200, 100)
+                    ctx.cmd_RG(1.0, 0.0, 0.0)
+                    ctx.cmd_rg(0.9, 0.9, 0.0)
+                    ctx.cmd_j(capypdf.LineJoinStyle.Bevel)
+                    ctx.cmd_m(50, 10)
+                    ctx.cmd_l(90, 90)
+                    ctx.cmd_l(10, 90)
+                    ctx.cmd_h()
+                    ctx.cmd_B()
+                with ctx.push_gstate():
+                    ctx.translate(0, 100)
+                    draw_intersect_shape(ctx)
+                    ctx.cmd_w(3)
+                    ctx.cmd_rg(0, 1, 0)
+                    ctx.cmd_RG(0.5, 0.1, 0.5)
+                    ctx.cmd_j(capypdf.LineJoinStyle.Round)
+                    ctx.cmd_B()
+                with ctx.push_gstate():
+                    ctx.translate(100, 100)
+                    ctx.cmd_w(2)
+                    ctx.cmd_rg(0, 1, 0);
+                    ctx.cmd_RG(0.5, 0.1, 0.5)
+                    draw_intersect_shape(ctx)
+                    ctx.cmd_Bstar()
+
+    @cleanup('rotate.pdf')
+    def test_rotate(self, ofilename):
+        with capypdf.Generator(ofilename, self.page_options(100, 100)) as g:
+            with g.page_draw_context() as ctx:
+                ctx.rotate(math.pi / 2)
+                ctx.cmd_re(10, 10, 80, 80)
+                ctx.cmd_f()
+        commands = page_streams(pathlib.Path(ofilename).read_bytes())
+        self.assertIn(b'0.000000 1.000000 -1.000000 0.000000 0.000000 0.000000 cm', commands)
+
+    # Same output as test_path with every path built by run_path_ops.
+    @validate_image('python_path_ops', 200, 200, oracle='python_path')
+    def test_path_ops(self, ofilename, w, h):
+        M, L, C, H = capypdf.PathOp.M, capypdf.PathOp.L, capypdf.PathOp.C, capypdf.PathOp.H
+        shape_ops = array.array('B', [op.value for op in (M, L, L, L, L, H)])
+        shape_coords = array.array('d', [50, 90, 80, 10, 10, 60, 90, 60, 20, 10])
+        opts = self.page_options(w, h)
+        with capypdf.Generator(ofilename, opts) as g:
+            with g.page_draw_context() as ctx:
+                with ctx.push_gstate():
+                    ctx.cmd_w(5)
+                    ctx.cmd_J(capypdf.LineCapStyle.Round)
+                    ctx.run_path_ops([M, C], [10, 10, 80, 10, 20, 90, 90, 90])
+                    ctx.cmd_S();
+                with ctx.push_gstate():
+                    ctx.cmd_w(10)
+                    ctx.translate(100, 0)
+                    ctx.cmd_RG(1.0, 0.0, 0.0)
+                    ctx.cmd_rg(0.9, 0.9, 0.0)
+                    ctx.cmd_j(capypdf.LineJoinStyle.Bevel)
+                    ctx.run_path_ops((M, L, L, H), (50, 90, 10, 10, 90, 10))
+                    ctx.cmd_B()
+                with ctx.push_gstate():
+                    ctx.translate(0, 100)
+                    ctx.run_path_ops(shape_ops, shape_coords)
+                    ctx.cmd_w(3)
+                    ctx.cmd_rg(0, 1, 0)
+                    ctx.cmd_RG(0.5, 0.1, 0.5)
+                    ctx.cmd_j(capypdf.LineJoinStyle.Round)
+                    ctx.cmd_B()
+                with ctx.push_gstate():
+                    ctx.translate(100, 100)
+                    ctx.cmd_w(2)
+                    ctx.cmd_rg(0, 1, 0);
+                    ctx.cmd_RG(0.5, 0.1, 0.5)
+                    ctx.run_path_ops(shape_ops, shape_coords)
+                    ctx.cmd_Bstar()
+
+    @cleanup('path_op_errors.pdf')
+    def test_path_op_errors(self, ofilename):
+        with capypdf.Generator(ofilename, self.page_options(100, 100)) as g:
+            with g.page_draw_context() as ctx:
+                # Unknown operator.
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops([99], [])
+                # Too few coordinates for the operator.
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops([capypdf.PathOp.M], [10])
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops([capypdf.PathOp.RE, capypdf.PathOp.L], [0, 0, 10, 10, 5])
+                # Negative counts can only come from the C API.
+                for num_ops, num_coords in ((-1, 0), (0, -1)):
+                    with self.assertRaises(capypdf.CapyPDFException):
+                        capypdf.check_error(capypdf.libfile.capy_dc_run_path_ops(ctx, None, num_ops, None, num_coords))
+                ctx.cmd_re(10, 10, 80, 80)
+                ctx.cmd_f()
+
+    @cleanup('array_arguments.pdf')
+    def test_array_arguments(self, ofilename):
+        M = capypdf.PathOp.M.value
+        L = capypdf.PathOp.L.value
+        with capypdf.Generator(ofilename, self.page_options(100, 100)) as g:
+            with g.page_draw_context() as ctx:
+                # Buffers of the right type, converted ones and strided views.
+                ctx.run_path_ops(array.array('B', [M, L]), array.array('d', [10, 10, 90, 90]))
+                ctx.run_path_ops(bytes([M, L]), array.array('f', [10, 10, 90, 90]))
+                ctx.run_path_ops(array.array('i', [M, L]), memoryview(array.array('d', [10, 0, 10, 0, 90, 0, 90, 0]))[::2])
+                ctx.run_path_ops(memoryview(array.array('B', [M, L])).toreadonly(), [10, 10, 90, 90])
+                # ctypes arrays report formats with an explicit byte order.
+                ctx.run_path_ops((ctypes.c_uint8 * 2)(M, L), (ctypes.c_double * 4)(10, 10, 90, 90))
+                ctx.run_path_ops([M, L], (ctypes.c_float * 4)(10, 10, 90, 90))
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops([M, L], (ctypes.c_int32 * 4)(10, 10, 90, 90))
+                # Integer buffers are never read as floats.
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops([M, L], b'\x0a\x0a\x5a\x5a')
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops([M, L], array.array('i', [10, 10, 90, 90]))
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops(array.array('d', [M, L]), [10, 10, 90, 90])
+                # Values that do not fit the C type.
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops([256], [])
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops(array.array('h', [-1]), [])
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops([M], ['10', '10'])
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops([M], None)
+                ctx.cmd_S()
+
+    @unittest.skipIf(numpy is None, 'NumPy not available.')
+    @cleanup('array_arguments_numpy.pdf')
+    def test_array_arguments_numpy(self, ofilename):
+        M = capypdf.PathOp.M.value
+        L = capypdf.PathOp.L.value
+        ops = numpy.array([M, L], dtype=numpy.uint8)
+        coords = numpy.array([[10, 10], [90, 90]], dtype=numpy.float64)
+        with capypdf.Generator(ofilename, self.page_options(100, 100)) as g:
+            with g.page_draw_context() as ctx:
+                ctx.run_path_ops(ops, coords)
+                ctx.run_path_ops(ops.astype(numpy.int64), coords.astype(numpy.float32))
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops(ops, coords.astype(numpy.int32))
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops(numpy.array([M, 300]), coords)
+                with self.assertRaises(capypdf.CapyPDFException):
+                    ctx.run_path_ops(ops, numpy.zeros((2, 4))[:, ::2])
+                ctx.cmd_S()
+
     @validate_image('python_textobj', 200, 200)
     def test_textobj(self, ofilename, w, h):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             font = g.load_font(noto_fontdir / 'NotoSerif-Regular.ttf')
             with g.page_draw_context() as ctx:
@@ -230,12 +528,23 @@ class TestPDFCreation(unittest.TestCase):
                 t.render_text('Using text object!')
                 ctx.render_text_obj(t)
 
+    # Same output as test_textobj. At the start of a text object Tm
+    # with a pure translation is equivalent to Td.
+    @validate_image('python_textobj_tm', 200, 200, oracle='python_textobj')
+    def test_textobj_tm(self, ofilename, w, h):
+        opts = self.page_options(w, h)
+        with capypdf.Generator(ofilename, opts) as g:
+            font = g.load_font(noto_fontdir / 'NotoSerif-Regular.ttf')
+            with g.page_draw_context() as ctx:
+                t = ctx.text_new()
+                t.cmd_Tf(font, 12.0)
+                t.cmd_Tm(1.0, 0.0, 0.0, 1.0, 10.0, 100.0)
+                t.render_text('Using text object!')
+                ctx.render_text_obj(t)
+
     @validate_image('python_kerning', 200, 200)
     def test_kerning(self, ofilename, w, h):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             font = g.load_font(noto_fontdir / 'NotoSerif-Regular.ttf')
             with g.page_draw_context() as ctx:
@@ -253,12 +562,30 @@ class TestPDFCreation(unittest.TestCase):
                 t.cmd_TJ(ks)
                 ctx.render_text_obj(t)
 
+    # Same output as test_kerning, built with the batched call from a
+    # string, a list and a buffer.
+    @validate_image('python_kerning_codepoints', 200, 200, oracle='python_kerning')
+    def test_kerning_codepoints(self, ofilename, w, h):
+        opts = self.page_options(w, h)
+        with capypdf.Generator(ofilename, opts) as g:
+            font = g.load_font(noto_fontdir / 'NotoSerif-Regular.ttf')
+            with g.page_draw_context() as ctx:
+                t = ctx.text_new()
+                ks = capypdf.TextSequence()
+                t.cmd_Tf(font, 24.0)
+                t.cmd_Td(10.0, 120.0)
+                ks.append_codepoints('AV')
+                t.cmd_TJ(ks)
+                t.cmd_Td(0, -40)
+                ks.append_codepoints([ord('A')])
+                ks.append_kerning(200)
+                ks.append_codepoints(array.array('I', [ord('V')]))
+                t.cmd_TJ(ks)
+                ctx.render_text_obj(t)
+
     @validate_image('python_shaping', 200, 200)
     def test_shaping(self, ofilename, w, h):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             font = g.load_font(noto_fontdir / 'NotoSerif-Regular.ttf')
             with g.page_draw_context() as ctx:
@@ -276,10 +603,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_smallcaps', 200, 200)
     def test_smallcaps(self, ofilename, w, h):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             font = g.load_font(noto_fontdir / 'NotoSerif-Regular.ttf')
             seq = ((54, 'S'),
@@ -306,10 +630,7 @@ class TestPDFCreation(unittest.TestCase):
     @validate_image('python_lab', 200, 200)
     def test_lab(self, ofilename, w, h):
         from math import sin, cos
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             lab = g.add_lab_colorspace(0.9505, 1.0, 1.089, -128, 127, -128, 127)
             with g.page_draw_context() as ctx:
@@ -338,10 +659,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_gstate', 200, 200)
     def test_gstate(self, ofilename, w, h):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             gstate = capypdf.GraphicsState()
             gstate.set_CA(0.1)
@@ -363,10 +681,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_icccolor', 200, 200)
     def test_icc(self, ofilename, w, h):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             cs = g.load_icc_profile('/usr/share/color/icc/ghostscript/a98.icc')
             sc = capypdf.Color()
@@ -382,10 +697,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @cleanup('transitions.pdf')
     def test_transitions(self, ofilename):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, 160, 90)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(160, 90)
         with capypdf.Generator(ofilename, opts) as g:
             with g.page_draw_context() as ctx:
                 pass
@@ -396,38 +708,71 @@ class TestPDFCreation(unittest.TestCase):
                 ctx.cmd_re(0, 0, 160, 90)
                 ctx.cmd_f()
 
+    @cleanup('structure_type.pdf')
+    def test_structure_item_type(self, ofilename):
+        with capypdf.Generator(ofilename, self.page_options(100, 100)) as g:
+            with self.assertRaises(capypdf.CapyPDFException) as cm:
+                g.add_structure_item('Document')
+            self.assertEqual(str(cm.exception), 'First argument must be a structure item or role id.')
+            with g.page_draw_context() as ctx:
+                pass
+
+    @unittest.skipUnless(os.environ.get('CAPYPDF_TEST_FASTLIB'), 'Compiled module not requested.')
+    def test_fastlib(self):
+        # The compiled module falls back to ctypes silently, which would
+        # make this whole run test the wrong thing.
+        self.assertIsNot(capypdf.fastlib, capypdf.libfile)
+        self.assertEqual(capypdf.fastlib.library_address(),
+                         ctypes.cast(capypdf.libfile.capy_error_message, ctypes.c_void_p).value)
+
+    def test_color_pool(self):
+        c = capypdf.Color()
+        c.set_rgb(1, 0, 0)
+        handle = c.get_underlying()
+        del c
+        # The C object of a deleted color is reused as is.
+        c = capypdf.Color()
+        self.assertIs(c.get_underlying(), handle)
+        del c
+
+        pool = capypdf.ColorPool(1)
+        h1 = pool.get()
+        h2 = pool.get()
+        self.assertIsNot(h1, h2)
+        pool.put(h1)
+        # The pool is full, so this one is destroyed.
+        pool.put(h2)
+        self.assertEqual(pool.handles, [h1])
+        self.assertIs(pool.get(), h1)
+        pool.put(h1)
+        pool.drain()
+        self.assertEqual(pool.handles, [])
+        self.assertEqual(pool.max_size, 0)
+        h3 = pool.get()
+        pool.put(h3)
+        self.assertEqual(pool.handles, [])
+
+    @cleanup('weakref.pdf')
+    def test_weakref(self, ofilename):
+        color = capypdf.Color()
+        self.assertIs(weakref.ref(color)(), color)
+        with capypdf.Generator(ofilename, self.page_options(100, 100)) as g:
+            self.assertIs(weakref.ref(g)(), g)
+            with g.page_draw_context() as ctx:
+                self.assertIs(weakref.ref(ctx)(), ctx)
+                with ctx.push_gstate() as state:
+                    self.assertIs(weakref.ref(state)(), state)
+
     @validate_image('python_rasterimage', 200, 200)
     def test_raster_image(self, ofilename, w, h):
-        opts = capypdf.Options()
-        props = capypdf.PageProperties()
-        props.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opts.set_default_page_properties(props)
+        opts = self.page_options(w, h)
         with capypdf.Generator(ofilename, opts) as g:
             ib = capypdf.RasterImageBuilder()
             ib.set_size(2, 3)
-            ba = bytearray()
-            ba.append(127)
-            ba.append(0)
-            ba.append(0)
-            ba.append(255)
-            ba.append(0)
-            ba.append(0)
-
-            ba.append(0)
-            ba.append(127)
-            ba.append(0)
-            ba.append(0)
-            ba.append(255)
-            ba.append(0)
-
-            ba.append(0)
-            ba.append(0)
-            ba.append(127)
-            ba.append(0)
-            ba.append(0)
-            ba.append(255)
-
-            ib.set_pixel_data(bytes(ba))
+            pixels = bytes((127, 0, 0, 255, 0, 0,
+                            0, 127, 0, 0, 255, 0,
+                            0, 0, 127, 0, 0, 255))
+            ib.set_pixel_data(pixels)
             image = ib.build()
             ipar = capypdf.ImagePdfProperties()
             iid = g.add_image(image, ipar)
@@ -438,10 +783,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_linestyles', 200, 200)
     def test_line_styles(self, ofilename, w, h):
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
+        opt = self.page_options(w, h)
         with capypdf.Generator(ofilename, opt) as gen:
             with gen.page_draw_context() as ctx:
                 ctx.scale(2.8*2.75, 2.75*2.83)
@@ -601,10 +943,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_shading_rgb', 200, 200)
     def test_shading_rgb(self, ofilename, w, h):
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
+        opt = self.page_options(w, h)
         with capypdf.Generator(ofilename, opt) as gen:
             c1 = capypdf.Color()
             c1.set_rgb(0.0, 1.0, 0.0)
@@ -677,13 +1016,80 @@ class TestPDFCreation(unittest.TestCase):
                     ctx.cmd_n()
                     ctx.cmd_sh(sh6id)
 
+    # Same output as test_shading_rgb with the triangle given as plain
+    # RGB values.
+    @validate_image('python_shading_rgb_batched', 200, 200, oracle='python_shading_rgb')
+    def test_shading_rgb_batched(self, ofilename, w, h):
+        opt = self.page_options(w, h)
+        with capypdf.Generator(ofilename, opt) as gen:
+            c1 = capypdf.Color()
+            c1.set_rgb(0.0, 1.0, 0.0)
+            c2 = capypdf.Color()
+            c2.set_rgb(1.0, 0.0, 1.0)
+            f2id = gen.add_type2_function(capypdf.Type2Function([0.0, 1.0], c1, c2, 1.0))
+            sh2id = gen.add_type2_shading(capypdf.Type2Shading(capypdf.DeviceColorspace.RGB,
+                                                               10.0, 50.0, 90.0, 50.0,
+                                                               f2id, False, False))
+            sh3id = gen.add_type3_shading(capypdf.Type3Shading(capypdf.DeviceColorspace.RGB,
+                                                               [50, 50, 40, 40, 30, 10],
+                                                               f2id, False, True))
+
+            sh4 = capypdf.Type4Shading(capypdf.DeviceColorspace.RGB, 0, 0, 100, 100)
+            sh4.add_triangles_rgb(array.array('d', [50, 90, 10, 10, 90, 10]),
+                                  [1, 0, 0,
+                                   0, 1, 0,
+                                   0, 0, 1])
+            c2 = capypdf.Color()
+            c2.set_rgb(0, 1, 0)
+            sh4.extend(2, [90, 90], c2)
+            sh4id = gen.add_type4_shading(sh4)
+
+            sh6 = capypdf.Type6Shading(capypdf.DeviceColorspace.RGB, 0, 0, 100, 100)
+            sh6_colors = [capypdf.Color(), capypdf.Color(), capypdf.Color(), capypdf.Color()]
+            sh6_colors[0].set_rgb(1, 0, 0)
+            sh6_colors[1].set_rgb(0, 1, 0)
+            sh6_colors[2].set_rgb(0, 0, 1)
+            sh6_colors[3].set_rgb(1, 0, 1)
+            sh6.add_patch(sh6_coords, sh6_colors)
+            sh6id = gen.add_type6_shading(sh6)
+
+            with gen.page_draw_context() as ctx:
+                draw_shading_quadrants(ctx, sh2id, sh3id, sh4id, sh6id)
+
+    def test_add_triangles_rgb_input(self):
+        sh4 = capypdf.Type4Shading(capypdf.DeviceColorspace.RGB, 0, 0, 100, 100)
+        coords = [50, 90, 10, 10, 90, 10]
+        rgb = [1, 0, 0, 0, 1, 0, 0, 0, 1]
+        sh4.add_triangles_rgb(coords * 2, rgb * 2)
+        sh4.add_triangles_rgb(tuple(coords), tuple(rgb))
+        sh4.add_triangles_rgb(array.array('d', coords), array.array('d', rgb))
+        # Read-only buffers are copied.
+        sh4.add_triangles_rgb(memoryview(array.array('d', coords)).toreadonly(), rgb)
+        sh4.add_triangles_rgb([], [])
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh4.add_triangles_rgb(coords[:5], rgb)
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh4.add_triangles_rgb(coords, rgb[:8])
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh4.add_triangles_rgb(coords, rgb * 2)
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh4.add_triangles_rgb(coords, None)
+
+    @unittest.skipIf(numpy is None, 'NumPy not available.')
+    def test_add_triangles_rgb_numpy(self):
+        sh4 = capypdf.Type4Shading(capypdf.DeviceColorspace.RGB, 0, 0, 100, 100)
+        coords = numpy.array([[50, 90], [10, 10], [90, 10]], dtype=numpy.float64)
+        rgb = numpy.eye(3)
+        sh4.add_triangles_rgb(coords, rgb)
+        # Float32 input is converted to doubles.
+        sh4.add_triangles_rgb(coords.astype(numpy.float32).ravel(), rgb)
+        # Non-contiguous 2D views must be copied or rejected, never misread.
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh4.add_triangles_rgb(numpy.zeros((3, 4))[:, ::2], rgb)
+
     @validate_image('python_shading_gray', 200, 200)
     def test_shading_gray(self, ofilename, w, h):
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
-        opt.set_colorspace(capypdf.DeviceColorspace.Gray)
+        opt = self.page_options(w, h, capypdf.DeviceColorspace.Gray)
         with capypdf.Generator(ofilename, opt) as gen:
             c1 = capypdf.Color()
             c1.set_gray(0.0)
@@ -756,14 +1162,69 @@ class TestPDFCreation(unittest.TestCase):
                     ctx.cmd_n()
                     ctx.cmd_sh(sh6id)
 
+    # Same output as test_shading_gray with the mesh shadings built by
+    # the batched calls.
+    @validate_image('python_shading_gray_batched', 200, 200, oracle='python_shading_gray')
+    def test_shading_gray_batched(self, ofilename, w, h):
+        opt = self.page_options(w, h, capypdf.DeviceColorspace.Gray)
+        with capypdf.Generator(ofilename, opt) as gen:
+            c1 = capypdf.Color()
+            c1.set_gray(0.0)
+            c2 = capypdf.Color()
+            c2.set_gray(1.0)
+            f2id = gen.add_type2_function(capypdf.Type2Function([0.0, 1.0], c1, c2, 1.0))
+            sh2id = gen.add_type2_shading(capypdf.Type2Shading(capypdf.DeviceColorspace.Gray,
+                                                               10.0, 50.0, 90.0, 50.0,
+                                                               f2id, False, False))
+            sh3id = gen.add_type3_shading(capypdf.Type3Shading(capypdf.DeviceColorspace.Gray,
+                                                               [50, 50, 40, 40, 30, 10],
+                                                               f2id, False, True))
+
+            sh4 = capypdf.Type4Shading(capypdf.DeviceColorspace.Gray, 0, 0, 100, 100)
+            c1 = capypdf.Color()
+            c1.set_gray(1)
+            c2 = capypdf.Color()
+            c2.set_gray(0)
+            c3 = capypdf.Color()
+            c3.set_gray(0.5)
+            sh4.add_triangles(array.array('d', [50, 90, 10, 10, 90, 10]), [c1, c2, c3])
+            sh4.extend(2, [90, 90], c2)
+            sh4id = gen.add_type4_shading(sh4)
+
+            sh6 = capypdf.Type6Shading(capypdf.DeviceColorspace.Gray, 0, 0, 100, 100)
+            sh6_colors = [capypdf.Color(), capypdf.Color(), capypdf.Color(), capypdf.Color()]
+            sh6_colors[0].set_gray(0)
+            sh6_colors[1].set_gray(0.3)
+            sh6_colors[2].set_gray(0.6)
+            sh6_colors[3].set_gray(1)
+            sh6.add_patches(sh6_coords, sh6_colors)
+            sh6id = gen.add_type6_shading(sh6)
+
+            with gen.page_draw_context() as ctx:
+                draw_shading_quadrants(ctx, sh2id, sh3id, sh4id, sh6id)
+
+    def test_shading_batch_errors(self):
+        color = capypdf.Color()
+        color.set_gray(0.5)
+        sh4 = capypdf.Type4Shading(capypdf.DeviceColorspace.Gray, 0, 0, 100, 100)
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh4.add_triangles([0] * 6, [color] * 2)
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh4.add_triangles([0] * 7, [color] * 3)
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh4.add_triangles([0] * 6, [color, color, 'gray'])
+        sh4.add_triangles([], [])
+        sh4.add_triangles([0] * 12, [color] * 6)
+        sh6 = capypdf.Type6Shading(capypdf.DeviceColorspace.Gray, 0, 0, 100, 100)
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh6.add_patches([0] * 24, [color] * 3)
+        with self.assertRaises(capypdf.CapyPDFException):
+            sh6.add_patches([0] * 23, [color] * 4)
+        sh6.add_patches([0] * 48, [color] * 8)
+
     @validate_image('python_shading_cmyk', 200, 200)
     def test_shading_cmyk(self, ofilename, w, h):
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
-        opt.set_colorspace(capypdf.DeviceColorspace.CMYK)
-        opt.set_device_profile(capypdf.DeviceColorspace.CMYK, icc_dir / 'FOGRA29L.icc')
+        opt = self.page_options(w, h, capypdf.DeviceColorspace.CMYK, 'FOGRA29L.icc')
         with capypdf.Generator(ofilename, opt) as gen:
             c1 = capypdf.Color()
             c1.set_cmyk(0.9, 0, 0.9, 0)
@@ -840,10 +1301,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_imagemask', 200, 200)
     def test_imagemask(self, ofilename, w, h):
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
+        opt = self.page_options(w, h)
         with capypdf.Generator(ofilename, opt) as gen:
             artfile = image_dir / 'comic-lines.png'
             self.assertTrue(artfile.exists())
@@ -880,10 +1338,7 @@ class TestPDFCreation(unittest.TestCase):
     def test_outline(self, ofilename):
         w = 200
         h = 200
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
+        opt = self.page_options(w, h)
         with capypdf.Generator(ofilename, opt) as gen:
             # Destinations point to a page that does not exist when they
             # are created but does exist when the PDF is generated.
@@ -925,14 +1380,83 @@ class TestPDFCreation(unittest.TestCase):
                 ctx.cmd_f()
         # FIXME, validate that the outline tree is correct.
 
+    @cleanup('outline_unchecked.pdf')
+    def test_outline_destination_unchecked(self, ofilename):
+        opt = self.page_options(200, 200)
+        with capypdf.Generator(ofilename, opt) as gen:
+            d = capypdf.Destination()
+            d.set_page(0)
+            d.set_xyz(10, 20, 3)
+            for i in range(3):
+                o = capypdf.Outline()
+                o.set_title(f'Outline {i}')
+                o.set_destination_unchecked(d)
+                gen.add_outline(o)
+            with gen.page_draw_context() as ctx:
+                ctx.cmd_re(50, 50, 100, 100)
+                ctx.cmd_f()
+        pdf = pathlib.Path(ofilename).read_bytes()
+        self.assertEqual(pdf.count(b'/XYZ 10.000000 20.000000 3.000000 ]'), 3)
+
+    # With CAPYPDF_TEST_FASTLIB set this runs the Destination and Outline
+    # functions of the compiled module.
+    @cleanup('outline_properties.pdf')
+    def test_outline_properties(self, ofilename):
+        if os.environ.get('CAPYPDF_TEST_FASTLIB'):
+            for funcname in ('capy_destination_set_page', 'capy_outline_set_rgb', 'capy_outline_set_f'):
+                self.assertNotIsInstance(getattr(capypdf.fastlib, funcname), ctypes._CFuncPtr)
+        opt = self.page_options(200, 200)
+        with capypdf.Generator(ofilename, opt) as gen:
+            d = capypdf.Destination()
+            with self.assertRaises(capypdf.CapyPDFException):
+                d.set_page(-1)
+            d.set_page(0)
+            d.set_xyz(5)
+            o = capypdf.Outline()
+            o.set_title('Properties')
+            o.set_destination(d)
+            o.set_rgb(0.25, 0.5, 1.0)
+            o.set_f(3)
+            gen.add_outline(o)
+            with gen.page_draw_context() as ctx:
+                ctx.cmd_re(50, 50, 100, 100)
+                ctx.cmd_f()
+        pdf = pathlib.Path(ofilename).read_bytes()
+        self.assertIn(b'/XYZ 5.000000 null null ]', pdf)
+        self.assertIn(b'/C [ 0.250000 0.500000 1.000000 ]', pdf)
+        self.assertIn(b'/F 3\n', pdf)
+
+    @cleanup('destination_xyz.pdf')
+    def test_destination_partial_xyz(self, ofilename):
+        opt = self.page_options(200, 200)
+        expected = []
+        with capypdf.Generator(ofilename, opt) as gen:
+            d = capypdf.Destination()
+            d.set_page(0)
+            for mask in range(8):
+                x = 10 + mask if mask & 1 else None
+                y = 20 + mask if mask & 2 else None
+                z = 1 + mask if mask & 4 else None
+                # Values left over from an earlier call must not leak
+                # into the unset coordinates.
+                d.set_xyz(99, 99, 99)
+                d.set_xyz(x, y, z)
+                o = capypdf.Outline()
+                o.set_title(f'Mask {mask}')
+                o.set_destination(d)
+                gen.add_outline(o)
+                expected.append(b'/XYZ ' + b''.join(b'null ' if v is None else b'%f ' % v for v in (x, y, z)) + b']')
+            with gen.page_draw_context() as ctx:
+                ctx.cmd_re(50, 50, 100, 100)
+                ctx.cmd_f()
+        pdf = pathlib.Path(ofilename).read_bytes()
+        self.assertNotIn(b'99.000000', pdf)
+        for e in expected:
+            self.assertIn(e, pdf)
+
     @validate_image('python_separation', 200, 200)
     def test_separation(self, ofilename, w, h):
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
-        opt.set_colorspace(capypdf.DeviceColorspace.CMYK)
-        opt.set_device_profile(capypdf.DeviceColorspace.CMYK, icc_dir / 'FOGRA29L.icc')
+        opt = self.page_options(w, h, capypdf.DeviceColorspace.CMYK, 'FOGRA29L.icc')
         with capypdf.Generator(ofilename, opt) as gen:
             red = capypdf.Color()
             red.set_cmyk(0.2, 1, 0.8, 0)
@@ -950,38 +1474,33 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_blendmodes', 200, 200)
     def test_blendmodes(self, ofilename, w, h):
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
+        opt = self.page_options(w, h)
         params = capypdf.ImagePdfProperties()
         with capypdf.Generator(ofilename, opt) as gen:
             bgimage_ri = gen.load_image(image_dir / 'flame_gradient.png')
             bgimage = gen.add_image(bgimage_ri, params)
             fgimage_ri = gen.load_image(image_dir / 'object_gradient.png')
             fgimage = gen.add_image(fgimage_ri, params)
+            bmids = []
+            for bm in capypdf.BlendMode:
+                g = capypdf.GraphicsState()
+                g.set_BM(bm)
+                bmids.append(gen.add_graphics_state(g))
             with gen.page_draw_context() as ctx:
                 with ctx.push_gstate():
                     ctx.scale(200, 200)
                     ctx.draw_image(bgimage)
                 for j in range(4):
                     for i in range(4):
-                        bm = capypdf.BlendMode(j*4+i)
-                        g = capypdf.GraphicsState()
-                        g.set_BM(bm)
-                        bmid = gen.add_graphics_state(g)
                         with ctx.push_gstate():
-                            ctx.cmd_gs(bmid)
+                            ctx.cmd_gs(bmids[j*4+i])
                             ctx.translate(50*i, 150-j*50)
                             ctx.scale(50, 50)
                             ctx.draw_image(fgimage)
 
     @validate_image('python_colorpattern', 200, 200)
     def test_colorpattern(self, ofilename, w, h):
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
+        opt = self.page_options(w, h)
         with capypdf.Generator(ofilename, opt) as gen:
             font = gen.load_font(noto_fontdir / 'NotoSerif-Regular.ttf')
             # Repeating pattern.
@@ -1017,10 +1536,7 @@ class TestPDFCreation(unittest.TestCase):
 
     @validate_image('python_annotate', 400, 100)
     def test_annotate(self, ofilename, w, h):
-        prop = capypdf.PageProperties()
-        prop.set_pagebox(capypdf.PageBox.Media, 0, 0, w, h)
-        opt = capypdf.Options()
-        opt.set_default_page_properties(prop)
+        opt = self.page_options(w, h)
         with capypdf.Generator(ofilename, opt) as gen:
             ta = capypdf.Annotation.new_text_annotation('This is a text ännotation.')
             ta.set_rectangle(30, 80, 40, 90)
@@ -1036,6 +1552,28 @@ class TestPDFCreation(unittest.TestCase):
                 ctx.annotate(embid)
                 ctx.render_text("<- This is a file attachment annotation", fid, 11, 50, 50)
 
+    # Same output as test_annotate. Annotations do not change the page
+    # contents, so the two labels can be rendered with one call.
+    @validate_image('python_text_runs', 400, 100, oracle='python_annotate')
+    def test_text_runs(self, ofilename, w, h):
+        opt = self.page_options(w, h)
+        with capypdf.Generator(ofilename, opt) as gen:
+            ta = capypdf.Annotation.new_text_annotation('This is a text ännotation.')
+            ta.set_rectangle(30, 80, 40, 90)
+            taid = gen.create_annotation(ta)
+            fid = gen.load_font(noto_fontdir / 'NotoSans-Regular.ttf')
+            embid = gen.embed_file(image_dir / '../readme.md')
+            emba = capypdf.Annotation.new_file_attachment_annotation(embid)
+            emba.set_rectangle(30, 50, 40, 60)
+            embid = gen.create_annotation(emba)
+            with gen.page_draw_context() as ctx:
+                ctx.annotate(taid)
+                ctx.annotate(embid)
+                ctx.render_text_runs([("<- This is a text annotation", 50, 80),
+                                      ("<- This is a file attachment annotation", 50, 50)],
+                                     fid, 11)
+                ctx.render_text_runs([], fid, 11)
+
     @validate_image('python_tagged', 200, 200)
     def test_tagged(self, ofilename, w, h):
         prop = capypdf.PageProperties()
@@ -1193,5 +1731,39 @@ class TestPDFCreation(unittest.TestCase):
                     ctx.scale(50, 50)
                     ctx.draw_image(image)
 
+def run_single_test(test_id):
+    suite = unittest.defaultTestLoader.loadTestsFromName(test_id, sys.modules[__name__])
+    output = io.StringIO()
+    result = unittest.TextTestRunner(stream=output, verbosity=2).run(suite)
+    return result.wasSuccessful(), output.getvalue()
+
+def run_parallel(num_jobs):
+    # Every test writes and renders its own files, so the tests can run
+    # in separate processes. This hides most of the time spent waiting
+    # for Ghostscript.
+    test_ids = []
+    pending = [unittest.defaultTestLoader.loadTestsFromModule(sys.modules[__name__])]
+    while pending:
+        for t in pending.pop():
+            if isinstance(t, unittest.TestSuite):
+                pending.append(t)
+            else:
+                test_ids.append(t.id().split('.', 1)[1])
+    failures = 0
+    with concurrent.futures.ProcessPoolExecutor(num_jobs) as executor:
+        for success, output in executor.map(run_single_test, sorted(test_ids)):
+            sys.stdout.write(output)
+            if not success:
+                failures += 1
+    print(f'Ran {len(test_ids)} tests, {failures} failed.')
+    return 1 if failures else 0
+
+# The suite can also be collected by other runners, such as
+# pytest -n auto, as long as they are started in the build directory.
 if __name__ == "__main__":
-    unittest.main()
+    sys.argv = sys.argv[0:1] + sys.argv[2:]
+    num_jobs = int(os.environ.get('CAPYPDF_TEST_JOBS', os.cpu_count() or 1))
+    if len(sys.argv) > 1 or num_jobs <= 1:
+        unittest.main()
+    else:
+        sys.exit(run_parallel(num_jobs))
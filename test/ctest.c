@@ -7,6 +7,71 @@
 #include <unistd.h>
 #endif
 
+static int test_text_sequence_codepoints(void) {
+    CapyPDF_EC rc;
+    CapyPDF_TextSequence *ts;
+    const uint32_t codepoints[3] = {'A', 'V', 0xFB03};
+
+    if((rc = capy_text_sequence_new(&ts)) != 0) {
+        fprintf(stderr, "%s\n", capy_error_message(rc));
+        return 1;
+    }
+
+    if((rc = capy_text_sequence_append_codepoints(ts, codepoints, 3)) != 0) {
+        fprintf(stderr, "%s\n", capy_error_message(rc));
+        return 1;
+    }
+
+    if((rc = capy_text_sequence_append_codepoints(ts, codepoints, 0)) != 0) {
+        fprintf(stderr, "%s\n", capy_error_message(rc));
+        return 1;
+    }
+
+    if(capy_text_sequence_append_codepoints(ts, codepoints, -1) == 0) {
+        fprintf(stderr, "Negative codepoint count was accepted.\n");
+        return 1;
+    }
+
+    if((rc = capy_text_sequence_destroy(ts)) != 0) {
+        fprintf(stderr, "%s\n", capy_error_message(rc));
+        return 1;
+    }
+    return 0;
+}
+
+static int test_type4_shading_triangles_rgb(void) {
+    CapyPDF_EC rc;
+    CapyPDF_Type4Shading *sh;
+    const double coords[12] = {50, 90, 10, 10, 90, 10, 10, 90, 50, 10, 90, 90};
+    const double rgb[18] = {1, 0, 0, 0, 1, 0, 0, 0, 1, 0, 0, 1, 0, 1, 0, 1, 0, 0};
+
+    if((rc = capy_type4_shading_new(CAPY_DEVICE_CS_RGB, 0, 0, 100, 100, &sh)) != 0) {
+        fprintf(stderr, "%s\n", capy_error_message(rc));
+        return 1;
+    }
+
+    if((rc = capy_type4_shading_add_triangles_rgb(sh, coords, rgb, 2)) != 0) {
+        fprintf(stderr, "%s\n", capy_error_message(rc));
+        return 1;
+    }
+
+    if((rc = capy_type4_shading_add_triangles_rgb(sh, coords, rgb, 0)) != 0) {
+        fprintf(stderr, "%s\n", capy_error_message(rc));
+        return 1;
+    }
+
+    if(capy_type4_shading_add_triangles_rgb(sh, coords, rgb, -1) == 0) {
+        fprintf(stderr, "Negative triangle count was accepted.\n");
+        return 1;
+    }
+
+    if((rc = capy_type4_shading_destroy(sh)) != 0) {
+        fprintf(stderr, "%s\n", capy_error_message(rc));
+        return 1;
+    }
+    return 0;
+}
+
 int main() {
     CapyPDF_EC rc;
     CapyPDF_Generator *gen;
@@ -83,5 +148,12 @@ int main() {
     }
     fclose(f);
     unlink(fname);
+
+    if(test_text_sequence_codepoints() != 0) {
+        return 1;
+    }
+    if(test_type4_shading_triangles_rgb() != 0) {
+        return 1;
+    }
     return 0;
 }